@@ -17,10 +17,12 @@ from utils.ddh_config import (
     dds_get_cfg_vessel_name, dds_get_cfg_aws_credential
 )
 import os
+from dds.hsm import hsm_load_all
 from utils.flag_paths import (LI_PATH_DDH_VERSION,
                               TMP_PATH_GPS_LAST_JSON,
                               TMP_PATH_BLE_IFACE,
-                              LI_PATH_CELL_FW, TMP_PATH_INET_VIA)
+                              LI_PATH_CELL_FW, TMP_PATH_INET_VIA,
+                              TMP_PATH_PDQ_STATE_JSON)
 
 
 CTT_API_OK = 'ok'
@@ -321,6 +323,23 @@ def api_get_internet_via():
         return None
 
 
+def api_get_post_download_queue():
+    try:
+        with open(TMP_PATH_PDQ_STATE_JSON, 'r') as f:
+            return json.load(f)
+    except (Exception, ) as ex:
+        print(f'{CTT_API_ER}: cannot api_get_post_download_queue -> {ex}')
+        return None
+
+
+def api_get_haul_summaries():
+    try:
+        return hsm_load_all()
+    except (Exception, ) as ex:
+        print(f'{CTT_API_ER}: cannot api_get_haul_summaries -> {ex}')
+        return None
+
+
 def api_get_ble_state():
     _p = '/usr/bin/hciconfig'
     rv_0 = _sh(f'{_p} -a | grep hci0')
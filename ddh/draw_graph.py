@@ -1,7 +1,7 @@
 from glob import glob
 
-import math
 import multiprocessing
+import os
 import sys
 import time
 from datetime import datetime
@@ -18,7 +18,9 @@ from pyqtgraph.Qt import QtGui
 from ddh.utils_graph import (utils_graph_read_fol_req_file,
                              utils_graph_get_abs_fol_list, process_graph_csv_data,
                              utils_graph_does_exist_fol_req_file,
-                             utils_graph_delete_fol_req_file, utils_graph_gfm_classify_file_wc_mode)
+                             utils_graph_delete_fol_req_file, utils_graph_gfm_classify_files_wc_mode,
+                             graph_lod_data)
+from dds.dlw import dlw_get_files, dlw_get_rescan, dlw_is_active
 from dds.timecache import is_it_time_to
 from mat.linux import linux_is_process_running
 from mat.utils import linux_is_rpi
@@ -33,6 +35,11 @@ from utils.logs import lg_gra as lg
 pg.setConfigOption('leftButtonPan', False)
 
 
+GFM_PERIOD_SECS = 600
+# when dl_files watcher is running, full scans are just a safety net
+GFM_PERIOD_SAFETY_SECS = 3600
+
+
 # plot objects
 p1 = None
 p2 = None
@@ -42,10 +49,12 @@ just_booted = True
 p3 = None
 p3_bak = None
 
+# zoom handler swapping level of detail of plotted lines
+_g_lod_cb = None
 
-def _percentile(data, perc: int):
-    size = len(data)
-    return sorted(data)[int(math.ceil((size * perc) / 100)) - 1]
+# graph data worker running, request waiting for it to finish
+_g_gw = None
+_g_gw_next = None
 
 
 def gfm_serve():
@@ -54,18 +63,18 @@ def gfm_serve():
     # ------------------------------------------------------------------
     _P_ = "dds_gfm"
 
-    def _gfm_serve():
+    def _gfm_serve(ls):
         setproctitle.setproctitle(_P_)
         try:
-            # step 1, grab all CSV files
-            fol = get_ddh_folder_path_dl_files()
-            ls_tdo = glob(f'{fol}/**/*_TDO.csv', recursive=True)
-            ls_dox = glob(f'{fol}/**/*_DissolvedOxygen.csv', recursive=True)
-            ls = ls_tdo + ls_dox
+            # step 1, grab all CSV files, unless watcher told us which
+            if not ls:
+                fol = get_ddh_folder_path_dl_files()
+                ls_tdo = glob(f'{fol}/**/*_TDO.csv', recursive=True)
+                ls_dox = glob(f'{fol}/**/*_DissolvedOxygen.csv', recursive=True)
+                ls = ls_tdo + ls_dox
 
-            # step 2, classify them
-            for i in ls:
-                utils_graph_gfm_classify_file_wc_mode(i)
+            # step 2, classify them, one index file per folder
+            utils_graph_gfm_classify_files_wc_mode(ls)
 
         except (Exception, ) as ex:
             lg.a(f'error: gfm_serve -> ex {ex}')
@@ -78,10 +87,16 @@ def gfm_serve():
     if linux_is_process_running(_P_):
         lg.a(f"error: seems last {_P_} took a long time")
     else:
+        # new CSV files seen by dl_files watcher
+        ls = [i for i in dlw_get_files('gfm') if os.path.exists(i)]
         s = f'launching {_P_}'
-        if is_it_time_to(s, 600):
+        _t = GFM_PERIOD_SAFETY_SECS if dlw_is_active() else GFM_PERIOD_SECS
+        if is_it_time_to(s, _t) or dlw_get_rescan('gfm'):
             # lg.a(s)
-            p = Process(target=_gfm_serve)
+            p = Process(target=_gfm_serve, args=([], ))
+            p.start()
+        elif ls:
+            p = Process(target=_gfm_serve, args=(ls, ))
             p.start()
 
 
@@ -225,10 +240,37 @@ def _graph_busy_sign_hide(a):
     a.lbl_graph_busy.setVisible(False)
 
 
-def _process_n_graph(a, r=''):
+def _graph_lod_disconnect():
+    global _g_lod_cb
+    if p1 and _g_lod_cb:
+        try:
+            p1.sigXRangeChanged.disconnect(_g_lod_cb)
+        except (Exception, ):
+            pass
+    _g_lod_cb = None
 
-    # get graph from passed app
-    g = a.g
+
+def _graph_lod_connect(data, k1, k2, c1, c2, clip_y1=False):
+    # only downsampled data comes with a level of detail pyramid
+    global _g_lod_cb
+    lod = data.get('lod')
+    if not lod:
+        return
+
+    def _cb(_, rng):
+        d = graph_lod_data(lod, *rng)
+        _x, _y1 = d['ISO 8601 Time'], d[k1]
+        if clip_y1:
+            _y1 = np.where(_y1 < 0, 0, _y1)
+        c1.setData(_x, _y1)
+        c2.setData(_x, d[k2])
+
+    _g_lod_cb = _cb
+    p1.sigXRangeChanged.connect(_cb)
+
+
+def _graph_request(a, r='') -> dict:
+    # runs on GUI thread, decides what to graph, data comes later
 
     # benchmark this graphing function
     start_ts = time.perf_counter()
@@ -288,6 +330,21 @@ def _process_n_graph(a, r=''):
             a.btn_g_next_haul.setEnabled(False)
             a.btn_g_next_haul.setVisible(False)
 
+    return {
+        'r': r,
+        'fol': fol,
+        'h': _ht,
+        'hi': a.g_haul_idx,
+        'zt': _zt,
+        'start_ts': start_ts
+    }
+
+
+def _graph_plot(a, req: dict, data: dict):
+    # runs on GUI thread, once GraphWorker prepared the data
+    g = a.g
+    r, fol, _zt, start_ts = req['r'], req['fol'], req['zt'], req['start_ts']
+
     # GUI buttons visible or not conditionally
     a.cb_g_switch_tp.setVisible(False)
 
@@ -305,6 +362,7 @@ def _process_n_graph(a, r=''):
         p2.clear()
     if p3:
         p3.clear()
+    _graph_lod_disconnect()
     p1 = g.plotItem
 
     # patch for bottom ticks, x are floats meaning timestamps
@@ -353,9 +411,8 @@ def _process_n_graph(a, r=''):
     p1.getAxis("right").setStyle(tickFont=font)
 
     # ==========================
-    # PROCESS folder's CSV data
+    # folder's CSV data, by now
     # ==========================
-    data = process_graph_csv_data(fol, _ht, a.g_haul_idx)
     if not data:
         lg.a(f'warning: no data to plot in folder {fol}')
         raise GraphException(f'no data to plot')
@@ -401,6 +458,7 @@ def _process_n_graph(a, r=''):
         y5 = data['Az TDO']
     y1 = data[lbl1]
     y2 = data[lbl2]
+    k1, k2 = lbl1, lbl2
 
     # see if we need Depth-axis inverted
     p1.invertY('Depth' in lbl1)
@@ -434,8 +492,10 @@ def _process_n_graph(a, r=''):
         # draw DO (y1) and T (y2) lines
         p1.setLabel("left", lbl1, **_sty(clr_1))
         p1.getAxis('right').setLabel(lbl2, **_sty(clr_2))
-        p1.plot(x, y1, pen=pen1, hoverable=True)
-        p2.addItem(pg.PlotCurveItem(x, y2, pen=pen2, hoverable=True, connect='finite'))
+        c1 = p1.plot(x, y1, pen=pen1, hoverable=True)
+        c2 = pg.PlotCurveItem(x, y2, pen=pen2, hoverable=True, connect='finite')
+        p2.addItem(c2)
+        _graph_lod_connect(data, k1, k2, c1, c2)
 
         # dynamic upper top of DO
         upper_top_do = 10
@@ -480,8 +540,10 @@ def _process_n_graph(a, r=''):
         # draw T and D lines
         p1.setLabel("left", lbl1, **_sty(clr_1))
         p1.getAxis('right').setLabel(lbl2, **_sty(clr_2))
-        p1.plot(x, y1, pen=pen1, hoverable=True)
-        p2.addItem(pg.PlotCurveItem(x, y2, pen=pen2, hoverable=True))
+        c1 = p1.plot(x, y1, pen=pen1, hoverable=True)
+        c2 = pg.PlotCurveItem(x, y2, pen=pen2, hoverable=True)
+        p2.addItem(c2)
+        _graph_lod_connect(data, k1, k2, c1, c2)
 
         # y-axis ranges, bottom-axis label
         p1.setYRange(0, max(y1) + _axis_room(y1), padding=0)
@@ -500,11 +562,11 @@ def _process_n_graph(a, r=''):
             p1.setLabel("left", lbl1, **_sty(clr_1))
             p1.getAxis('right').setLabel(lbl2, **_sty(clr_2))
             # set any pressure value < 0 to 0
-            arr = np.array(y1)
-            arr[arr < 0] = 0
-            y1 = list(arr)
-            p1.plot(x, y1, pen=pen1, hoverable=True)
-            p2.addItem(pg.PlotCurveItem(x, y2, pen=pen2, hoverable=True, connect='finite'))
+            y1 = np.where(y1 < 0, 0, y1)
+            c1 = p1.plot(x, y1, pen=pen1, hoverable=True)
+            c2 = pg.PlotCurveItem(x, y2, pen=pen2, hoverable=True, connect='finite')
+            p2.addItem(c2)
+            _graph_lod_connect(data, k1, k2, c1, c2, clip_y1=True)
 
             # left y inverted: 1st parameter y-up, 2nd y-low
             # .1 prevents displaying negative pressure values
@@ -566,9 +628,7 @@ def _process_n_graph(a, r=''):
             g.getPlotItem().hideAxis('right')
 
             # set any pressure value < 0 to 0
-            arr = np.array(y1)
-            arr[arr < 0] = 0
-            y1 = list(arr)
+            y1 = np.where(y1 < 0, 0, y1)
 
             # chopped, this graph messes x-axis when outliers
             # ls_idx = _get_outliers_indexes(y2, 10, 90)
@@ -615,65 +675,126 @@ def _process_n_graph(a, r=''):
     try:
         if met == 'TDO':
             if (not is_rpi) or (is_rpi and r == 'BLE'):
-                dp = data['Depth (fathoms) TDO']
-                dt = data['Temperature (F) TDO']
-                # calculate 80th percentile to ensure bottom sea values
-                p80 = _percentile(dp, 80)
-                ls_p, ls_t = [], []
-                for i, p in enumerate(dp):
-                    if p >= p80:
-                        ls_p.append(dp[i])
-                        ls_t.append(dt[i])
-                lg.a(f'debug: percentile 80 for TDO data is {p80}')
+                # means of bottom runs, see seg_find()
+                sm = data['summary']
                 s = 'haul summary\n'
                 s += f'{t1}\n{t2}\n'
-                s += '{:5.2f} fathoms\n'.format(np.nanmean(ls_p))
-                s += '{:5.2f} °F'.format(np.nanmean(ls_t))
+                s += '{:5.2f} fathoms\n'.format(sm['Depth (fathoms)'])
+                s += '{:5.2f} °F'.format(sm['Temperature (F)'])
                 _u(f"{STATE_DDS_BLE_DOWNLOAD_STATISTICS}/{s}")
 
         if met == 'DO':
             if (not is_rpi) or (is_rpi and r == 'BLE'):
-                _do = data['DO Concentration (mg/l) DO']
-                dt = data['Temperature (F) DO']
-                wat = data['Water Detect (%) DO']
-                ls_do, ls_dt = [], []
-                if len(wat):
-                    lg.a('debug: filtering DO-2 data values by water %')
-                    for i, w in enumerate(wat):
-                        if w >= 50:
-                            ls_do.append(_do[i])
-                            ls_dt.append(dt[i])
-                else:
-                    lg.a('debug: adding all values for DO-1 data')
-                    ls_do = _do
-                    ls_dt = dt
+                # means of in-water runs, all values for DO-1 data
+                sm = data['summary']
                 s = 'haul summary\n'
                 s += f'{t1}\n{t2}\n'
-                s += '{:5.2f} mg_l\n'.format(np.nanmean(ls_do))
-                s += '{:5.2f} °F'.format(np.nanmean(ls_dt))
+                s += '{:5.2f} mg_l\n'.format(sm['DO Concentration (mg/l)'])
+                s += '{:5.2f} °F'.format(sm['Temperature (F)'])
                 _u(f"{STATE_DDS_BLE_DOWNLOAD_STATISTICS}/{s}")
     except (Exception, ) as ex:
         lg.a(f'warning: exception {ex} while doing summary box')
 
 
-def process_n_graph(a, r=''):
+class GraphWorker(QtCore.QThread):
+
+    # ---------------------------------------------------------------
+    # prepares graph data off the GUI thread, so the touchscreen and
+    # GUI watchdog keep going, one at a time, newer requests cancel
+    # the running one, see process_n_graph()
+    # ---------------------------------------------------------------
+
+    # request, data, exception text
+    sig_done = QtCore.pyqtSignal(object, object, str)
+
+    def __init__(self, req: dict):
+        super().__init__()
+        self.req = req
+        self.cancelled = False
+
+    def run(self):
+        data, e = {}, ''
+        try:
+            data = process_graph_csv_data(self.req['fol'], self.req['h'],
+                                          self.req['hi'],
+                                          cancel=lambda: self.cancelled)
+        except (Exception, ) as ex:
+            e = str(ex)
+        self.sig_done.emit(self.req, data, e)
+
+
+def _graph_error(a, e, ex=''):
+    if ex:
+        # not GraphException, but python errors such as IndexError
+        e = 'undefined error, see log'
+        lg.a(f"error: graph_embed -> {ex}")
+    a.g.setTitle(e, color="red", size="15pt")
+    a.g.getAxis('bottom').setLabel("")
+
+
+def _graph_worker_start(a, req):
+    global _g_gw
+    global _g_gw_next
+    if _g_gw:
+        # it will finish soon and start this one, see below
+        _g_gw.cancelled = True
+        _g_gw_next = (a, req)
+        return
+    _g_gw = GraphWorker(req)
+    _g_gw.sig_done.connect(lambda *args: _graph_worker_done(a, *args))
+    _g_gw.finished.connect(_graph_worker_finished)
+    _g_gw.start()
+
+
+def _graph_worker_done(a, req, data, ex):
+    # GUI thread, dropped when a newer request arrived meanwhile
+    if _g_gw_next:
+        lg.a(f'graph request for {os.path.basename(req["fol"])} cancelled')
+        return
     try:
-        _graph_busy_sign_show(a)
-        _process_n_graph(a, r)
+        if ex:
+            _graph_error(a, '', ex)
+            return
+        _graph_plot(a, req, data)
         # remove any past error
         a.g.setTitle('')
 
     except GraphException as e:
         # errors such as "no data files to graph"
-        a.g.setTitle(e, color="red", size="15pt")
-        a.g.getAxis('bottom').setLabel("")
+        _graph_error(a, e)
 
     except (Exception,) as ex:
-        # not GraphException, but python errors such as IndexError
-        e = 'undefined error, see log'
-        a.g.setTitle(e, color="red", size="15pt")
-        lg.a(f"error: graph_embed -> {str(ex)}")
-        a.g.getAxis('bottom').setLabel("")
+        _graph_error(a, '', str(ex))
 
     finally:
         _graph_busy_sign_hide(a)
+
+
+def _graph_worker_finished():
+    global _g_gw
+    global _g_gw_next
+    _g_gw.deleteLater()
+    _g_gw = None
+    if _g_gw_next:
+        a, req = _g_gw_next
+        _g_gw_next = None
+        _graph_worker_start(a, req)
+
+
+def process_n_graph(a, r=''):
+    try:
+        _graph_busy_sign_show(a)
+        req = _graph_request(a, r)
+
+    except GraphException as e:
+        _graph_error(a, e)
+        _graph_busy_sign_hide(a)
+        return
+
+    except (Exception,) as ex:
+        _graph_error(a, '', str(ex))
+        _graph_busy_sign_hide(a)
+        return
+
+    # busy sign hidden when data is plotted
+    _graph_worker_start(a, req)
@@ -629,10 +629,6 @@ class DDH(QMainWindow, d_m.Ui_MainWindow):
         self.map_filename = m
 
     def click_chk_plt_only_inside_water(self, _):
-        from ddh.utils_graph import cached_read_csv
-        # from ddh.utils_graph import process_graph_csv_data
-        cached_read_csv.cache_clear()
-        # process_graph_csv_data.cache_clear()
         p = LI_PATH_PLOT_ONLY_DATA_IN_WATER
         if self.chk_plt_only_inside_water.isChecked():
             pathlib.Path(p).touch()
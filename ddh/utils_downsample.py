@@ -0,0 +1,84 @@
+import math
+import numpy as np
+
+
+"""
+graph downsampling keeping peaks, each bucket of samples
+is reduced to the indexes of its minimum and maximum values
+"""
+
+
+# above this number of points, series get downsampled
+DS_MAX_POINTS = 8000
+# about the number of points left after downsampling
+DS_TARGET_POINTS = 2400
+
+
+def ds_minmax_idx(y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """
+    returns indexes of min and max of y for each bucket,
+    buckets with only NaN keep their first one so gaps stay
+    """
+    n = len(y)
+    b = math.ceil(n / n_buckets)
+    yy = np.full(n_buckets * b, np.nan)
+    yy[:n] = y
+    yy = yy.reshape(n_buckets, b)
+    nan = np.isnan(yy)
+    i_lo = np.argmin(np.where(nan, np.inf, yy), axis=1)
+    i_hi = np.argmax(np.where(nan, -np.inf, yy), axis=1)
+    start = np.arange(n_buckets) * b
+    idx = np.concatenate((start + i_lo, start + i_hi))
+    return idx[idx < n]
+
+
+def ds_get_idx(ls_y: list, n: int, n_buckets: int) -> np.ndarray:
+    """
+    ls_y: series sharing the same time axis of length n,
+    returns sorted indexes keeping the peaks of all of them
+    """
+    ls = [np.array([0, n - 1])]
+    for y in ls_y:
+        if len(y):
+            ls.append(ds_minmax_idx(y[:n], n_buckets))
+    return np.unique(np.concatenate(ls))
+
+
+def ds_take(a: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    # some series can be shorter than the time axis
+    if len(a) < len(idx) or (len(idx) and idx[-1] >= len(a)):
+        return a[idx[idx < len(a)]]
+    return a[idx]
+
+
+class DsPyramid:
+
+    # ---------------------------------------------------------------
+    # level of detail pyramid, each level keeps min / max indexes of
+    # buckets 4 times bigger than the previous one, zooming in picks
+    # the finest level with no more than DS_TARGET_POINTS visible
+    # ---------------------------------------------------------------
+
+    def __init__(self, x: np.ndarray, ls_y: list):
+        self.x = x
+        n = len(x)
+        self.levels = []
+        b = 4
+        while 1:
+            idx = ds_get_idx(ls_y, n, math.ceil(n / b))
+            self.levels.append(idx)
+            if len(idx) <= DS_TARGET_POINTS:
+                break
+            b *= 4
+
+    def idx_for_range(self, x0, x1) -> np.ndarray:
+        # one more point at each side, so lines reach the borders
+        i0 = max(0, int(np.searchsorted(self.x, x0)) - 1)
+        i1 = min(len(self.x), int(np.searchsorted(self.x, x1)) + 1)
+        if i1 - i0 <= DS_MAX_POINTS:
+            return np.arange(i0, i1)
+        for idx in self.levels:
+            j0, j1 = np.searchsorted(idx, [i0, i1])
+            if j1 - j0 <= DS_TARGET_POINTS:
+                return idx[j0:j1]
+        return self.levels[-1]
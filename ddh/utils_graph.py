@@ -1,22 +1,33 @@
+import json
 import os
-import pathlib
 import time
-from functools import lru_cache
 from glob import glob
 from os.path import basename
 import numpy as np
-import dateutil.parser as dp
 import pandas as pd
+from ddh.utils_downsample import DS_MAX_POINTS, DsPyramid, ds_take
+from dds.hsm import hsm_combine, hsm_get_fresh, hsm_load
+from ddh.utils_segment import SEG_BOTTOM, SEG_WATER, seg_find, seg_remap, seg_take
 from utils.ddh_config import dds_get_cfg_flag_graph_test_mode, ddh_get_file_flag_plot_wc
-from utils.ddh_shared import (get_ddh_folder_path_dl_files,
+from utils.ddh_shared import (atomic_write, get_ddh_folder_path_dl_files,
                               get_dl_folder_path_from_mac, TESTMODE_FILENAMEPREFIX)
 from utils.logs import lg_gra as lg
 from utils.flag_paths import TMP_PATH_GRAPH_REQ_JSON
-from utils.units import dbar_to_fathoms
+from utils.units import dbar_to_fathoms, celsius_to_fahrenheit
 
 CTT_ATM_PRESSURE_DBAR = 10.1325
 
 
+# index of water column mode for all CSV files in a dl_files/<mac> folder
+GFM_INDEX_FILENAME = '._gfm_index.json'
+# rows read per block when looking for in-water data
+GFM_BLOCK_ROWS = 20000
+
+
+# last 'all' hauls graph data, see process_graph_csv_data()
+_g_inc = {}
+
+
 def _gfm_build_filename_wc(path):
     # wc: water column, legacy versions called fast (profiling) mode graph (fmg)
     bn = '._' + os.path.basename(path)[:-4] + '.fmg'
@@ -29,72 +40,119 @@ def _gfm_build_filename_no_wc(path):
     return f'{os.path.dirname(path)}/{bn}'
 
 
-def utils_graph_gfm_classify_file_wc_mode(p):
-    # p: full path
-    p = str(p)
-    bn = os.path.basename(p)
-    _is_tdo = p.endswith('_TDO.csv')
-    _is_dox = p.endswith('_DissolvedOxygen.csv')
-    if not _is_tdo and not _is_dox:
-        lg.a('error: can only set water column mode on lowell CSV files')
-        return
+def _gfm_index_load(fol) -> dict:
+    # k: CSV file basename, v: [is water column, CSV mtime_ns]
+    try:
+        with open(f'{fol}/{GFM_INDEX_FILENAME}') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (Exception, ) as ex:
+        lg.a(f'error: loading graph water column index {fol} -> {ex}')
+        return {}
+
+
+def _gfm_index_save(fol, d: dict):
+    with atomic_write(f'{fol}/{GFM_INDEX_FILENAME}') as f:
+        json.dump(d, f)
+
+
+def _gfm_any_above(p, col, v) -> bool:
+    # stops reading at the first block with a value above v,
+    # first 2 data rows are skipped, as the legacy classifier did
+    with pd.read_csv(p, usecols=[col], skiprows=[1, 2],
+                     chunksize=GFM_BLOCK_ROWS) as rd:
+        for blk in rd:
+            c = pd.to_numeric(blk.iloc[:, 0], errors='coerce')
+            if (c.to_numpy(dtype=np.float64) > v).any():
+                return True
+    return False
 
-    # leave when already exists water column mode file
-    f_wc = _gfm_build_filename_wc(p)
-    f_nowc = _gfm_build_filename_no_wc(p)
-    if os.path.exists(f_wc):
-        return
-    if os.path.exists(f_nowc):
-        return
 
-    # short files considered to have NO water column info
+def _gfm_classify_wc(p) -> bool:
+    """
+    True when CSV file p has in-water data
+    """
+    bn = os.path.basename(p)
     with open(p, 'r') as f:
-        ll = f.readlines()
-        if len(ll) <= 3:
-            pathlib.Path(f_nowc).touch()
-            return
-
-    if _is_tdo:
-        _bn = os.path.basename(p)
-        lg.a(f'graph water column mode: processing TDO file {_bn}')
+        hdr = f.readline().rstrip('\n').split(',')
+        # short files considered to have NO water column info
+        n = sum(1 for _ in zip(range(3), f))
+    if n <= 2:
+        return False
+
+    if p.endswith('_TDO.csv'):
         # headers: ISO 8601 Time,Temperature (C),Pressure (dbar),Ax,Ay,Az
-        # ll[3]: 2024-09-13T14:52:49.000Z,19.120,10.462,-176,19,-162
-        i_pc = ll[0].split(',').index('Pressure (dbar)')
-        for i in ll[3:]:
-            vp = float(i.split(',')[i_pc])
-            if vp > 15:
-                lg.a(f'graph water column mode: ON for TDO file {bn}')
-                pathlib.Path(f_wc).touch()
-                return
-
-        pathlib.Path(f_nowc).touch()
-        lg.a(f'graph water column mode: OFF for TDO file {bn}')
-        return
+        rv = _gfm_any_above(p, hdr.index('Pressure (dbar)'), 15)
+        lg.a(f'graph water column mode: {"ON" if rv else "OFF"} for TDO file {bn}')
+        return rv
 
-    _is_do2 = 'Water' in ll[0]
-    if not _is_do2:
+    if not [i for i in hdr if 'Water' in i]:
         # this way, we force them to appear on graphs
         lg.a(f'graph water column mode: ON for DO-1 file {bn}')
-        pathlib.Path(f_wc).touch()
-        return
+        return True
+
+    # headers: ts,mg/l,%,C,W%
+    rv = _gfm_any_above(p, len(hdr) - 1, 50)
+    lg.a(f'graph water column mode: {"ON" if rv else "OFF"} for DO-2 file {bn}')
+    return rv
 
-    if _is_do2:
-        _bn = os.path.basename(p)
-        lg.a(f'graph water column mode: processing DO-2 file {_bn}')
-        # headers: ts,mg/l,%,C,W%
-        # ll[3]: 2024-06-29T10:49:51.000Z,10.14,98.27,13.93,94.00
-        for i in ll[3:]:
-            w_cur = float(i.split(',')[-1])
-            if w_cur > 50:
-                lg.a(f'graph water column mode: ON for DO-2 file {bn}')
-                pathlib.Path(f_wc).touch()
-                return
-
-        pathlib.Path(f_nowc).touch()
-        lg.a(f'graph water column mode: OFF for DO-2 file {bn}')
-        return
 
-    lg.a(f'error: _utils_graph_classify_file_wc_mode for unknown file {p}')
+def utils_graph_gfm_classify_files_wc_mode(ls: list):
+    """
+    classifies Lowell CSV files in ls, full paths, storing
+    results in the index of each folder, written once per folder
+    """
+    d_fol = {}
+    for p in ls:
+        p = str(p)
+        if not p.endswith('_TDO.csv') and not p.endswith('_DissolvedOxygen.csv'):
+            lg.a('error: can only set water column mode on lowell CSV files')
+            continue
+        d_fol.setdefault(os.path.dirname(p), []).append(p)
+
+    for fol, ls_p in d_fol.items():
+        d = _gfm_index_load(fol)
+        n = len(d)
+        changed = False
+        for p in ls_p:
+            bn = os.path.basename(p)
+            try:
+                t = os.stat(p).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if bn in d and d[bn][1] == t:
+                continue
+
+            # import legacy marker files, then get rid of them
+            f_wc = _gfm_build_filename_wc(p)
+            f_nowc = _gfm_build_filename_no_wc(p)
+            if bn not in d and os.path.exists(f_wc):
+                d[bn] = [True, t]
+            elif bn not in d and os.path.exists(f_nowc):
+                d[bn] = [False, t]
+            else:
+                try:
+                    d[bn] = [_gfm_classify_wc(p), t]
+                except (Exception, ) as ex:
+                    lg.a(f'error: classifying water column mode {bn} -> {ex}')
+                    continue
+            for i in (f_wc, f_nowc):
+                if os.path.exists(i):
+                    os.unlink(i)
+            changed = True
+
+        if changed:
+            _gfm_index_save(fol, d)
+            lg.a(f'graph water column index {os.path.basename(fol)}: '
+                 f'{len(d) - n} new, {len(d)} files')
+
+
+def utils_graph_gfm_get_fol_no_wc(fol) -> set:
+    """
+    basenames of CSV files in folder fol without in-water data
+    """
+    return {k for k, v in _gfm_index_load(fol).items() if not v[0]}
 
 
 def utils_graph_get_abs_fol_list() -> list:
@@ -163,22 +221,233 @@ def utils_graph_set_fol_req_file(mac):
         lg.a(f"error: graph_set_fol_req_file() {ex}")
 
 
-def _data_get_prune_period(x, met):
-    if len(x) > 8000:
-        lg.a(f'data pruning: faster graph for {met}')
-        return int(len(x) / 600)
-    return 1
+def _data_concat(ls: list) -> np.ndarray:
+    if not ls:
+        return np.empty(0)
+    return np.concatenate(ls).astype(np.float64, copy=False)
+
+
+def _gch_build_filename(path):
+    # gch: graph cache, binary columns sidecar of a CSV file
+    bn = '._' + os.path.basename(path)[:-4] + '.npy'
+    return f'{os.path.dirname(path)}/{bn}'
 
 
-@lru_cache(maxsize=512)
-def cached_read_csv(f):
+def _seg_build_filename(path):
+    # seg: in-water and bottom runs of a CSV file, see seg_find()
+    bn = '._' + os.path.basename(path)[:-4] + '.seg.npy'
+    return f'{os.path.dirname(path)}/{bn}'
+
+
+def _gch_save(a, f, f_out):
+    # atomic, same mtime as CSV file so we know it is up-to-date
+    st = os.stat(f)
+    with atomic_write(f_out, 'wb') as fo:
+        np.save(fo, a)
+        fo.flush()
+        os.utime(fo.fileno(), ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _gch_create(f, f_gch):
+    # 'ISO 8601 Time' column is stored as epoch seconds, others as floats
     df = pd.read_csv(f)
-    if df.empty:
+    c_t = 'ISO 8601 Time'
+    cols = [c for c in df.columns if c != c_t]
+    a = np.empty(len(df), dtype=[(c, '<f8') for c in [c_t] + cols])
+    ts = pd.to_datetime(df[c_t], utc=True, format='ISO8601')
+    a[c_t] = ts.to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    for c in cols:
+        # bad values such as '000nan' end up as NaN
+        a[c] = pd.to_numeric(df[c], errors='coerce').to_numpy(dtype=np.float64)
+
+    # segments go first, a fresh sidecar means both are up-to-date
+    p = a['Pressure (dbar)'] if 'Pressure (dbar)' in cols else None
+    wat = a['Water Detect (%)'] if 'Water Detect (%)' in cols else None
+    _gch_save(seg_find(p, wat), f, _seg_build_filename(f))
+    _gch_save(a, f, f_gch)
+
+
+def graph_read_csv(f) -> np.ndarray:
+    """
+    returns CSV file data as a structured array memory-mapped
+    from its sidecar, which gets rebuilt when CSV file changes
+    """
+    f_gch = _gch_build_filename(f)
+    try:
+        t = os.stat(f).st_mtime_ns
+        ok = os.stat(f_gch).st_mtime_ns == t
+        ok = ok and os.stat(_seg_build_filename(f)).st_mtime_ns == t
+    except FileNotFoundError:
+        ok = False
+    if not ok:
+        _gch_create(f, f_gch)
+    a = np.load(f_gch, mmap_mode='r')
+    if not len(a):
         lg.a(f'warning: no data for file {f}')
-    return df
+    return a
 
 
-def process_graph_csv_data(fol, h, hi) -> dict:
+def graph_read_segments(f) -> np.ndarray:
+    """
+    in-water and bottom runs of CSV file f, call graph_read_csv() first
+    """
+    return np.load(_seg_build_filename(f))
+
+
+def _hs_stats(v: np.ndarray):
+    v = v[~np.isnan(v)]
+    if not len(v):
+        return None
+    p10, p50, p90 = np.percentile(v, [10, 50, 90])
+    return {k: round(float(i), 3) for k, i in
+            zip(('min', 'max', 'mean', 'p10', 'p50', 'p90'),
+                (v.min(), v.max(), v.mean(), p10, p50, p90))}
+
+
+def _hs_mean(v: np.ndarray):
+    v = v[~np.isnan(v)]
+    return round(float(v.mean()), 3) if len(v) else None
+
+
+def graph_haul_summary(f) -> dict:
+    """
+    summary record of a TDO or DO CSV file f, a haul, to be saved
+    by hsm_save(), also leaves graph sidecars of f up-to-date
+    """
+    f = str(f)
+    is_tdo = f.endswith('_TDO.csv')
+    if not is_tdo and not f.endswith('_DissolvedOxygen.csv'):
+        return {}
+    t_ns = os.stat(f).st_mtime_ns
+    a = graph_read_csv(f)
+    segs = graph_read_segments(f)
+    if is_tdo:
+        # same rows as graph, bad temperature ones are not used
+        keep = ~np.isnan(a['Temperature (C)'])
+        a = a[keep]
+        segs = seg_remap(segs, keep)
+    n = len(a)
+    if not n:
+        return {}
+
+    cols = {
+        'pressure_dbar': 'Pressure (dbar)',
+        'temperature_c': 'Temperature (C)' if is_tdo else 'DO Temperature (C)',
+        'do_mg_l': 'Dissolved Oxygen (mg/l)'
+    }
+    cols = {k: v for k, v in cols.items() if v in a.dtype.names}
+
+    # bottom runs, or all data for DO-1 files without water detect
+    b = {k: seg_take(a[v], segs, SEG_BOTTOM) if len(segs) else a[v]
+         for k, v in cols.items()}
+    n_w = int(sum(e - s for s, e, k in segs if k == SEG_WATER))
+    has_wat = is_tdo or 'Water Detect (%)' in a.dtype.names
+    t = a['ISO 8601 Time']
+
+    return {
+        'folder': os.path.dirname(f),
+        'file': os.path.basename(f),
+        'mtime_ns': t_ns,
+        'type': 'TDO' if is_tdo else 'DO',
+        'count': n,
+        'start': float(t[0]),
+        'end': float(t[-1]),
+        'in_water_fraction': round(n_w / n, 3) if has_wat else None,
+        'stats': {k: _hs_stats(np.asarray(a[v])) for k, v in cols.items()},
+        'bottom': dict(n=len(next(iter(b.values()))),
+                       **{k: _hs_mean(v) for k, v in b.items()})
+    }
+
+
+def _data_summary_hsm(met, hs: dict) -> dict:
+    # same as _data_summary() but from combined haul summaries
+    t = celsius_to_fahrenheit(hs.get('temperature_c', np.nan))
+    if met == 'TDO':
+        p = hs.get('pressure_dbar', np.nan)
+        return {
+            'Depth (fathoms)': dbar_to_fathoms(p - CTT_ATM_PRESSURE_DBAR),
+            'Temperature (F)': t
+        }
+    if met == 'DO':
+        return {
+            'DO Concentration (mg/l)': hs.get('do_mg_l', np.nan),
+            'Temperature (F)': t
+        }
+    return {}
+
+
+def _data_summary(met, segs, doc, dot, tdo_t, tdo_p) -> dict:
+    # summary box means, slices of bottom / in-water runs
+    if met == 'TDO':
+        p = seg_take(tdo_p, segs, SEG_BOTTOM)
+        t = seg_take(tdo_t, segs, SEG_BOTTOM)
+        return {
+            'Depth (fathoms)': np.nanmean(dbar_to_fathoms(p - CTT_ATM_PRESSURE_DBAR)),
+            'Temperature (F)': np.nanmean(celsius_to_fahrenheit(t))
+        }
+    if met == 'DO':
+        # DO-1 loggers have no water detect, so no runs
+        if len(segs):
+            doc = seg_take(doc, segs, SEG_WATER)
+            dot = seg_take(dot, segs, SEG_WATER)
+        return {
+            'DO Concentration (mg/l)': np.nanmean(doc),
+            'Temperature (F)': np.nanmean(celsius_to_fahrenheit(dot))
+        }
+    return {}
+
+
+def _data_build(met, is_moana, x, t, p, doc, dot, wat,
+                tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az) -> dict:
+
+    # Celsius to Fahrenheit
+    tf = celsius_to_fahrenheit(t)
+    dotf = celsius_to_fahrenheit(dot)
+    tdo_tf = celsius_to_fahrenheit(tdo_t)
+
+    # Depth conversion to fathoms ftm
+    pftm = dbar_to_fathoms(p - CTT_ATM_PRESSURE_DBAR)
+    tdo_pftm = dbar_to_fathoms(tdo_p - CTT_ATM_PRESSURE_DBAR)
+    # Moana loggers pressure does not include atm. pressure
+    if is_moana:
+        pftm = p * .5468
+
+    return {
+        'metric': met,
+        'ISO 8601 Time': x,
+        'Temperature (C) TP': t,
+        'Temperature (F) TP': tf,
+        'Pressure (dbar) TP': p,
+        'Depth (fathoms) TP': pftm,
+        'DO Concentration (mg/l) DO': doc,
+        'Temperature (C) DO': dot,
+        'Temperature (F) DO': dotf,
+        'Water Detect (%) DO': wat,
+        'Temperature (C) TDO': tdo_t,
+        'Temperature (F) TDO': tdo_tf,
+        'Pressure (dbar) TDO': tdo_p,
+        'Depth (fathoms) TDO': tdo_pftm,
+        'Ax TDO': tdo_ax,
+        'Ay TDO': tdo_ay,
+        'Az TDO': tdo_az,
+    }
+
+
+def graph_lod_data(lod: dict, x0, x1) -> dict:
+    """
+    same keys as process_graph_csv_data() for time range x0, x1,
+    taken from the level of detail pyramid finest enough for it
+    """
+    idx = lod['pyramid'].idx_for_range(x0, x1)
+    cols = (ds_take(i, idx) for i in lod['raw'])
+    return _data_build(lod['metric'], lod['is_moana'], *cols)
+
+
+def process_graph_csv_data(fol, h, hi, cancel=None) -> dict:
+    """
+    cancel: optional callable, when returning True
+    we leave as soon as possible returning nothing
+    """
 
     _g_ff_t = sorted(glob(f"{fol}/*_Temperature.csv"))
     _g_ff_p = sorted(glob(f"{fol}/*_Pressure.csv"))
@@ -199,10 +468,9 @@ def process_graph_csv_data(fol, h, hi) -> dict:
         return {'error': e}
 
     # files NOT_NO_WC = YES_WC + ones still not processed
-    _g_ff_tdo_wc = [i for i in _g_ff_tdo
-                    if not os.path.exists(_gfm_build_filename_no_wc(i))]
-    _g_ff_dot_wc = [i for i in _g_ff_dot
-                    if not os.path.exists(_gfm_build_filename_no_wc(i))]
+    no_wc = utils_graph_gfm_get_fol_no_wc(fol)
+    _g_ff_tdo_wc = [i for i in _g_ff_tdo if basename(i) not in no_wc]
+    _g_ff_dot_wc = [i for i in _g_ff_dot if basename(i) not in no_wc]
 
     # error moana
     # MOANA_0744_99_240221160010_Temperature.csv
@@ -265,25 +533,62 @@ def process_graph_csv_data(fol, h, hi) -> dict:
     # calculate time performance of data-grabbing procedure
     start_ts = time.perf_counter()
 
+    # -------------------------------------------------------------
+    # 'all' hauls of the same folder as last time, such as after a
+    # download, only files newer than the ones in _g_inc are read
+    # -------------------------------------------------------------
+    global _g_inc
+    key = (fol, met, ddh_get_file_flag_plot_wc())
+    # one list per kind of file, T and P files get appended separately
+    ls_st = [[(f, os.stat(f).st_mtime_ns, basename(f) not in no_wc) for f in ff]
+             for ff in (_g_ff_t, _g_ff_p, _g_ff_dot, _g_ff_tdo)]
+    inc = {}
+    if (h == 'all' and _g_inc.get('key') == key
+            and all(i[:len(j)] == j for i, j in zip(ls_st, _g_inc['files']))):
+        inc = _g_inc
+        n_new = sum(len(i) - len(j) for i, j in zip(ls_st, inc['files']))
+        lg.a(f'appending {n_new} new files to last graph data')
+    ff_old = {i[0] for ls in inc.get('files', []) for i in ls}
+
     # ---------
     # read CSV
     # ---------
+    # lists of per-file arrays, concatenated only once at the end
     x = []
-    t, p, pftm, mpf = [], [], [], []
+    t, p = [], []
     doc, dot, wat = [], [], []
     tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az = [], [], [], [], []
+    # in-water and bottom runs, as indexes of concatenated arrays
+    segs = []
+    ff_segs = []
+    n = 0
     is_moana = False
+    if inc:
+        x, t, p, doc, dot, wat, tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az = (
+            [i] for i in inc['cols'])
+        segs = [inc['segs']]
+        ff_segs = list(inc['ff_segs'])
+        n = len(inc['cols'][0])
+        is_moana = inc['is_moana']
 
     if met == 'TP':
         for f in _g_ff_t:
+            if f in ff_old:
+                continue
+            if cancel and cancel():
+                return {}
             lg.a(f'reading T file {basename(f)}')
-            df = cached_read_csv(f)
-            x += list(df['ISO 8601 Time'])
-            t += list(df['Temperature (C)'])
+            df = graph_read_csv(f)
+            x.append(df['ISO 8601 Time'])
+            t.append(df['Temperature (C)'])
         for f in _g_ff_p:
+            if f in ff_old:
+                continue
+            if cancel and cancel():
+                return {}
             lg.a(f'reading P file {basename(f)}')
-            df = cached_read_csv(f)
-            p += list(df['Pressure (dbar)'])
+            df = graph_read_csv(f)
+            p.append(df['Pressure (dbar)'])
             is_moana = 'MOANA' in f or 'moana' in f
 
     elif met == 'DO':
@@ -294,27 +599,32 @@ def process_graph_csv_data(fol, h, hi) -> dict:
         else:
             lg.a(f'debug: plot only IN-WATER DOX files')
         for f in _g_ff_dot:
+            if f in ff_old:
+                continue
             bn = os.path.basename(f)
+            if cancel and cancel():
+                return {}
             lg.a(f'reading DO file {bn}')
-            df = cached_read_csv(f)
-            x += list(df['ISO 8601 Time'])
-            _m = len(list(df['ISO 8601 Time']))
+            df = graph_read_csv(f)
+            x.append(df['ISO 8601 Time'])
+            _m = len(df)
 
             # -----------------------------------------
             # use water column filter for data or not
             # -----------------------------------------
             if plt_all or (plt_wc and f in _g_ff_dot_wc):
-                doc += list(df['Dissolved Oxygen (mg/l)'])
-                dot += list(df['DO Temperature (C)'])
-                try:
-                    wat += list(df['Water Detect (%)'])
-                except (Exception, ):
-                    pass
+                segs.append(graph_read_segments(f) + [n, n, 0])
+                ff_segs.append(f)
+                doc.append(df['Dissolved Oxygen (mg/l)'])
+                dot.append(df['DO Temperature (C)'])
+                if 'Water Detect (%)' in df.dtype.names:
+                    wat.append(df['Water Detect (%)'])
             elif plt_wc and f not in _g_ff_dot_wc:
                 lg.a(f'warning: file {bn} no-show for water column mode')
                 # so when plotting with connect='finite' these don't appear
-                doc += [np.nan] * _m
-                dot += [np.nan] * _m
+                doc.append(np.full(_m, np.nan))
+                dot.append(np.full(_m, np.nan))
+            n += _m
 
     elif met == 'TDO':
         plt_wc = ddh_get_file_flag_plot_wc()
@@ -324,86 +634,100 @@ def process_graph_csv_data(fol, h, hi) -> dict:
         else:
             lg.a(f'debug: plot only IN-WATER TDO files')
         for f in _g_ff_tdo:
+            if f in ff_old:
+                continue
             bn = os.path.basename(f)
+            if cancel and cancel():
+                return {}
             lg.a(f'reading {met} file {bn}')
-            df = cached_read_csv(f)
-            x += list(df['ISO 8601 Time'])
-            _m = len(list(df['ISO 8601 Time']))
+            df = graph_read_csv(f)
 
             # -----------------------------------------
             # use water column filter for data or not
             # -----------------------------------------
             if plt_all or (plt_wc and f in _g_ff_tdo_wc):
-                tdo_t += list(df['Temperature (C)'])
-                tdo_p += list(df['Pressure (dbar)'])
-                tdo_ax += list(df['Ax'])
-                tdo_ay += list(df['Ay'])
-                tdo_az += list(df['Az'])
+                # bad temperature rows, '000nan' in CSV, are not plotted
+                keep = ~np.isnan(df['Temperature (C)'])
+                df = df[keep]
+                segs.append(seg_remap(graph_read_segments(f), keep) + [n, n, 0])
+                ff_segs.append(f)
+                x.append(df['ISO 8601 Time'])
+                tdo_t.append(df['Temperature (C)'])
+                tdo_p.append(df['Pressure (dbar)'])
+                tdo_ax.append(df['Ax'])
+                tdo_ay.append(df['Ay'])
+                tdo_az.append(df['Az'])
             elif plt_wc and f not in _g_ff_tdo_wc:
+                x.append(df['ISO 8601 Time'])
+                _m = len(df)
                 lg.a(f'warning: file {bn} no-show due to water column mode')
                 # so when plotting with connect='finite' these don't display
                 # although the space occupied by them is there
-                tdo_t += [np.nan] * _m
-                tdo_p += [np.nan] * _m
+                tdo_t.append(np.full(_m, np.nan))
+                tdo_p.append(np.full(_m, np.nan))
+            n += len(x[-1])
 
     # simplify stuff
     if not met:
         lg.a(f'error: graph_get_all_csv() unknown metric {met}')
         return {}
 
+    # one copy from memory-mapped files to contiguous arrays
+    x, t, p, doc, dot, wat, tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az = (
+        _data_concat(i) for i in (x, t, p, doc, dot, wat,
+                                  tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az))
+
+    segs = np.concatenate(segs) if segs else np.empty((0, 3), dtype=np.int64)
+
+    # summary box, from haul summaries DDS saved when converting
+    hs = hsm_load(fol)
+    ls_hs = [hsm_get_fresh(hs, i) for i in ff_segs]
+    if ls_hs and all(ls_hs):
+        summary = _data_summary_hsm(met, hsm_combine(ls_hs))
+    else:
+        summary = _data_summary(met, segs, doc, dot, tdo_t, tdo_p)
+
     # things we don't plot
     if len(x) == 1:
         e = f'error: few data points in file {os.path.basename(f)}'
         lg.a(e)
         return {'error': e}
 
-    # ----------------------
-    # prune data or not
-    # ----------------------
-    n = _data_get_prune_period(x, met)
-
-    x = x[::n]
-    t = t[::n]
-    p = p[::n]
-    doc = doc[::n]
-    dot = dot[::n]
-    wat = wat[::n]
-    tdo_t = tdo_t[::n]
-    tdo_p = tdo_p[::n]
-    tdo_ax = tdo_ax[::n]
-    tdo_ay = tdo_ay[::n]
-    tdo_az = tdo_az[::n]
-
-    # Celsius to Fahrenheit
-    tf = [(c * 9 / 5) + 32 for c in t]
-    dotf = [(c * 9 / 5) + 32 for c in dot]
-    bad_idx = []
-    for i_c, c in enumerate(tdo_t):
-        if c == '000nan':
-            bad_idx.append(i_c)
-    for i in bad_idx:
-        x.pop(i)
-        tdo_t.pop(i)
-        tdo_p.pop(i)
-        tdo_ax.pop(i)
-        tdo_ay.pop(i)
-        tdo_az.pop(i)
-    tdo_tf = []
-    for c in tdo_t:
-        tdo_tf.append(((float(c) * 9) /5) + 32)
-
-    # Depth conversion to fathoms ftm
-    pftm = [dbar_to_fathoms(d - CTT_ATM_PRESSURE_DBAR) for d in p]
-    tdo_pftm = [dbar_to_fathoms(d - CTT_ATM_PRESSURE_DBAR) for d in tdo_p]
-    # Moana loggers pressure does not include atm. pressure
-    mpf = [d * .5468 for d in p]
-    pftm = pftm if not is_moana else mpf
+    if cancel and cancel():
+        return {}
 
-    # convert 2018-11-11T13:00:00.000 --> seconds
-    try:
-        x = [dp.isoparse(f'{i}Z').timestamp() for i in x]
-    except (Exception, ):
-        x = [dp.isoparse(f'{i}').timestamp() for i in x]
+    # remember this data, see _g_inc above
+    if h == 'all':
+        _g_inc = {
+            'key': key,
+            'files': ls_st,
+            'cols': (x, t, p, doc, dot, wat, tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az),
+            'segs': segs,
+            'ff_segs': ff_segs,
+            'is_moana': is_moana
+        }
+
+    # -------------------------------------------------
+    # downsample data or not, before any unit conversion,
+    # keeps min and max of plotted series in each bucket
+    # -------------------------------------------------
+    pruned = len(x) > DS_MAX_POINTS
+    lod = None
+    if pruned:
+        lg.a(f'data downsampling: faster graph for {met}')
+        ls_y = {'TP': [t, p], 'DO': [doc, dot], 'TDO': [tdo_p, tdo_t]}[met]
+
+        # full resolution kept for zooming, see graph_lod_data()
+        raw = (x, t, p, doc, dot, wat, tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az)
+        lod = {'pyramid': DsPyramid(x, ls_y), 'raw': raw,
+               'metric': met, 'is_moana': is_moana}
+        idx = lod['pyramid'].levels[-1]
+        x, t, p, doc, dot, wat, tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az = (
+            ds_take(i, idx) for i in (x, t, p, doc, dot, wat,
+                                      tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az))
+
+    d = _data_build(met, is_moana, x, t, p, doc, dot, wat,
+                    tdo_t, tdo_p, tdo_ax, tdo_ay, tdo_az)
 
     # display time performance of data-grabbing procedure
     end_ts = time.perf_counter()
@@ -415,24 +739,11 @@ def process_graph_csv_data(fol, h, hi) -> dict:
     lg_t = lg_t if not is_moana else 'Moana'
 
     # build output dictionary to graph
-    return {
-        'metric': met,
-        'ISO 8601 Time': x,
-        'Temperature (C) TP': t,
-        'Temperature (F) TP': tf,
-        'Pressure (dbar) TP': p,
-        'Depth (fathoms) TP': pftm,
-        'DO Concentration (mg/l) DO': doc,
-        'Temperature (C) DO': dot,
-        'Temperature (F) DO': dotf,
-        'Water Detect (%) DO': wat,
-        'Temperature (C) TDO': tdo_t,
-        'Temperature (F) TDO': tdo_tf,
-        'Pressure (dbar) TDO': tdo_p,
-        'Depth (fathoms) TDO': tdo_pftm,
-        'Ax TDO': tdo_ax,
-        'Ay TDO': tdo_ay,
-        'Az TDO': tdo_az,
-        'pruned': n != 1,
-        'logger_type': lg_t
-    }
+    d.update({
+        'pruned': pruned,
+        'logger_type': lg_t,
+        'lod': lod,
+        'segments': segs,
+        'summary': summary
+    })
+    return d
@@ -58,6 +58,7 @@ from utils.ddh_shared import (
     STATE_DDS_NOTIFY_CLOUD_ERR,
     STATE_DDS_NOTIFY_CONVERSION_ERR,
     STATE_DDS_NOTIFY_CONVERSION_OK,
+    STATE_DDS_NOTIFY_PDQ,
     STATE_DDS_NOTIFY_BOAT_NAME,
     STATE_DDS_NOTIFY_GPS,
     STATE_DDS_GPS_POWER_CYCLE,
@@ -92,6 +93,7 @@ dim_done_day = 0
 dim_done_night = 0
 g_last_ci = ''
 g_last_ct = ''
+g_last_cnv = ''
 
 
 class ButtonPressEvent:
@@ -601,6 +603,7 @@ def _gui_parse_udp(my_app, s, ip="127.0.0.1"):
 
     global g_last_ci
     global g_last_ct
+    global g_last_cnv
 
     # variables for big icon and text
     ci = ""
@@ -766,9 +769,17 @@ def _gui_parse_udp(my_app, s, ip="127.0.0.1"):
     # CONVERSION states
     # -------------------
     elif f == STATE_DDS_NOTIFY_CONVERSION_ERR:
-        a.lbl_cnv.setText("cnv_error")
+        g_last_cnv = "cnv_error"
+        a.lbl_cnv.setText(g_last_cnv)
     elif f == STATE_DDS_NOTIFY_CONVERSION_OK:
-        a.lbl_cnv.setText("cnv_ok")
+        g_last_cnv = "cnv_ok"
+        a.lbl_cnv.setText(g_last_cnv)
+    elif f == STATE_DDS_NOTIFY_PDQ:
+        # v: number of post-download jobs not finished yet
+        if v and v != "0":
+            a.lbl_cnv.setText(f"cnv_busy {v}")
+        else:
+            a.lbl_cnv.setText(g_last_cnv)
 
     # -----------
     # GRAPH fields
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+"""
+haul segmentation, finds where a haul is in the water and at
+the bottom as runs of [start, end) indexes, so summaries and
+water column filters are slices instead of scans of all data
+"""
+
+
+# same thresholds as graph water column mode classifier
+SEG_WATER_DBAR = 15
+SEG_WATER_PCT = 50
+# samples deeper than this percentile of in-water ones are bottom
+SEG_BOTTOM_PERC = 80
+SEG_WATER = 0
+SEG_BOTTOM = 1
+
+
+def seg_runs(m: np.ndarray) -> np.ndarray:
+    """
+    run-length encoding of boolean mask m,
+    returns (k, 2) array of [start, end) of its True runs
+    """
+    d = np.diff(m.astype(np.int8), prepend=0, append=0)
+    return np.column_stack((np.flatnonzero(d == 1),
+                            np.flatnonzero(d == -1)))
+
+
+def _seg_nearest_rank(v: np.ndarray, perc: int):
+    # same percentile as graph summary box always used
+    v = np.sort(v[~np.isnan(v)])
+    if not len(v):
+        return np.nan
+    return v[max(0, int(np.ceil(len(v) * perc / 100)) - 1)]
+
+
+def seg_find(p=None, wat=None) -> np.ndarray:
+    """
+    p: pressure (dbar), wat: water detect (%), any of them,
+    returns (k, 3) array of [start, end, kind] of in-water
+    and bottom runs, kind being SEG_WATER or SEG_BOTTOM
+    """
+    ls = []
+    if wat is not None and len(wat):
+        # DO loggers, no pressure so bottom is all in-water data
+        r = seg_runs(wat >= SEG_WATER_PCT)
+        ls = [(r, SEG_WATER), (r, SEG_BOTTOM)]
+    elif p is not None and len(p):
+        m = p > SEG_WATER_DBAR
+        # shallow hauls, bottom is taken from all of them
+        v = p[m] if m.any() else p
+        with np.errstate(invalid='ignore'):
+            m_b = p >= _seg_nearest_rank(v, SEG_BOTTOM_PERC)
+        ls = [(seg_runs(m), SEG_WATER), (seg_runs(m_b), SEG_BOTTOM)]
+
+    rv = [np.column_stack((r, np.full(len(r), k))) for r, k in ls]
+    if not rv:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.concatenate(rv).astype(np.int64)
+
+
+def seg_remap(segs: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    """
+    segs indexes after removing rows where boolean keep is False
+    """
+    c = np.concatenate(([0], np.cumsum(keep)))
+    rv = segs.copy()
+    rv[:, :2] = c[segs[:, :2]]
+    return rv[rv[:, 0] < rv[:, 1]]
+
+
+def seg_take(a: np.ndarray, segs: np.ndarray, kind) -> np.ndarray:
+    """
+    concatenated slices of a for runs of this kind
+    """
+    ls = [a[s:e] for s, e, k in segs if k == kind]
+    if not ls:
+        return np.empty(0)
+    return np.concatenate(ls)
@@ -8,8 +8,6 @@ import uuid
 import time
 from tzlocal import get_localzone
 
-from ddh.utils_graph import utils_graph_set_fol_req_file
-from dds.aws import aws_cp
 from dds.ble_dl_dox import ble_interact_do1_or_do2
 from dds.ble_dl_dox_lsb import ble_interact_dox_lsb
 from dds.ble_dl_moana import ble_interact_moana
@@ -26,11 +24,11 @@ from dds.macs import (
     is_mac_in_orange,
     add_mac_orange,
 )
+from dds.pdq import pdq_add_cnv, pdq_add_aws_cp, pdq_add_graph
 from dds.notifications_v2 import (
     notify_logger_download,
     notify_logger_error_retries,
     LoggerNotification,
-    notify_logger_dox_hypoxia,
     notify_ddh_error_hw_ble
 )
 from dds.state import ddh_state
@@ -39,15 +37,10 @@ from mat.ble.ble_mat_utils import (
     ble_mat_systemctl_restart_bluetooth,
     ble_mat_get_antenna_type_v2
 )
-from mat.data_converter import default_parameters, DataConverter
-from mat.lix import id_lid_file_flavor, LID_FILE_V2, LID_FILE_V1
-from mat.lix_dox import is_a_do2_file
-from mat.lix_pr import convert_lix_file
 from mat.utils import linux_is_rpi
 from utils.ddh_config import (
     dds_get_cfg_flag_purge_this_mac_dl_files_folder,
     dds_get_cfg_logger_sn_from_mac,
-    dds_get_cfg_logger_mac_from_sn,
     exp_get_use_lsb_for_tdo_loggers,
     exp_get_use_lsb_for_dox_loggers,
     exp_get_use_aws_cp,
@@ -65,7 +58,6 @@ from utils.ddh_shared import (
     STATE_DDS_NOTIFY_HISTORY,
     STATE_DDS_BLE_ERROR_MOANA_PLUGIN,
     STATE_DDS_BLE_CONNECTING,
-    STATE_DDS_REQUEST_GRAPH,
     get_ddh_do_not_rerun_flag_li,
     STATE_DDS_BLE_RUN_STATUS,
     STATE_DDS_BLE_HARDWARE_ERROR,
@@ -94,58 +86,6 @@ def _ble_show_logger_spotted(mac, _b, _o):
             lg.a(f"logger {sn} under short forget time")
 
 
-def _ble_detect_hypoxia_after_download(f_lid, bat, g, u=''):
-    try:
-        if not f_lid.endswith('.lid') or not is_a_do2_file(f_lid):
-            return
-        f_csv = f_lid.replace('.lid', '_DissolvedOxygen.csv')
-        if not os.path.exists(f_csv):
-            return
-
-        # f_csv: 2404725_lab_20240407_230609.csv
-        sn = os.path.basename(f_csv).split('_')[0]
-        mac = dds_get_cfg_logger_mac_from_sn(sn)
-        ln = LoggerNotification(mac, sn, 'DOX', bat)
-        ln.uuid_interaction = u
-        with open(f_csv, 'r') as f:
-            ll = f.readlines()
-            # headers: 'ISO 8601 Time,elapsed time (s),agg. time(s),Dissolved Oxygen (mg/l)...
-            for i in ll[1:]:
-                do_mg_l = float(i.split(',')[3])
-                if do_mg_l <= 0.0:
-                    notify_logger_dox_hypoxia(g, ln)
-                    break
-    except (Exception, ) as ex:
-        lg.a(f'error: testing _ble_detect_hypoxia -> {ex}')
-
-
-def _ble_convert_lid_after_download(d):
-    ls_lid = d['dl_files']
-    ls_lid = [f for f in ls_lid if '.lid' in f]
-    bat = d['battery_level']
-    g = d['gps']
-    u = d['uuid_interaction']
-
-    for f in ls_lid:
-        # f: absolute file path ending in .lid
-        _bn = os.path.basename(f)
-        n = id_lid_file_flavor(f)
-        lg.a(f"post-download conversion of LID v{n} file {_bn} started")
-
-        # ----------------------------
-        # convert DOX and TDO v2 files
-        # ----------------------------
-        if n == LID_FILE_V2:
-            convert_lix_file(f)
-            _ble_detect_hypoxia_after_download(f, bat, g, u)
-
-        if n == LID_FILE_V1:
-            # do the old MAT library conversion
-            parameters = default_parameters()
-            DataConverter(f, parameters).convert()
-        lg.a(f"OK: post-download conversion of LID v{n} file {_bn} ended")
-
-
 def _ble_analyze_and_graph_logger_result(rv,
                                          g,
                                          ln: LoggerNotification,
@@ -169,12 +109,11 @@ def _ble_analyze_and_graph_logger_result(rv,
         else:
             _u(f"{STATE_DDS_BLE_DOWNLOAD_OK}/{sn}")
 
-        # ------------------------------
-        # graph loggers just downloaded
-        # ------------------------------
-        utils_graph_set_fol_req_file(mac)
-        lg.a(f"triggering post-download graph for logger {sn}, mac {mac}")
-        _u(STATE_DDS_REQUEST_GRAPH)
+        # -----------------------------------------------
+        # graph loggers just downloaded, queued after the
+        # conversion of their files so CSV files exist
+        # -----------------------------------------------
+        pdq_add_graph(mac, sn)
         return
 
     # NOT success
@@ -285,7 +224,7 @@ async def _ble_interact_one_logger(mac, info: str, h, g):
         rerun = notes['rerun']
         notes['uuid_interaction'] = uuid_interaction
         _we_took_dl_notes = True
-        _ble_convert_lid_after_download(notes)
+        pdq_add_cnv(notes)
 
     elif _ble_logger_is_rn4020(mac, info):
         rv = await ble_interact_rn4020(mac, info, g, hs)
@@ -316,7 +255,7 @@ async def _ble_interact_one_logger(mac, info: str, h, g):
         rerun = notes['rerun']
         notes['uuid_interaction'] = uuid_interaction
         _we_took_dl_notes = True
-        _ble_convert_lid_after_download(notes)
+        pdq_add_cnv(notes)
 
     else:
         lg.a(f'error: this should not happen, info {info}')
@@ -345,7 +284,7 @@ async def _ble_interact_one_logger(mac, info: str, h, g):
         ln.gfv = notes['gfv']
         ln.bat = notes['battery_level']
         if exp_get_use_aws_cp() == 1:
-            aws_cp(notes['dl_files'])
+            pdq_add_aws_cp(notes['dl_files'])
 
     # plot this logger download
     _ble_analyze_and_graph_logger_result(rv, g, ln, _crit_error)
@@ -1,6 +1,17 @@
+import argparse
+import functools
 import glob
+import json
+import multiprocessing
 import os
 import pathlib
+import sqlite3
+import time
+
+from ddh.utils_graph import graph_haul_summary
+from dds.dlw import dlw_get_files, dlw_get_rescan
+from dds.hsm import hsm_save
+from dds.pdq import pdq_get_cnv_done, pdq_is_busy
 from dds.timecache import is_it_time_to
 from mat.data_converter import default_parameters, DataConverter
 from mat.data_file_factory import load_data_file
@@ -8,18 +19,27 @@ from mat.lix import (
     id_lid_file_flavor, LID_FILE_V1,
     LID_FILE_V2, lid_file_v2_has_sensor_data_type
 )
+from mat.linux import linux_is_process_running
 from mat.lix_pr import convert_lix_file
 from mat.utils import linux_ls_by_ext
 from utils.logs import lg_cnv as lg
 from utils.ddh_shared import (
     send_ddh_udp_gui as _u,
     get_ddh_folder_path_dl_files,
+    get_ddh_file_path_cnv_batch,
+    get_ddh_file_path_cnv_manifest,
+    atomic_write,
+    dds_pool_size,
+    dds_pool_worker_init,
+    dds_sqlite_prune,
+    NAME_EXE_DDS,
     STATE_DDS_NOTIFY_CONVERSION_ERR,
     STATE_DDS_NOTIFY_CONVERSION_OK
 )
+import numpy as np
 import pandas as pd
 
-from utils.flag_paths import TMP_PATH_CNV_REQUESTED_VIA_GUI
+from utils.flag_paths import TMP_PATH_CNV_REQUESTED_VIA_GUI, TMP_PATH_CNV_RETRY_FAILED
 
 """
 code in this file only takes care of LID data files
@@ -29,122 +49,478 @@ code in this file only takes care of LID data files
 PERIOD_CNV_SECS = 3600 * 12
 BAROMETRIC_PRESSURE_SEA_LEVEL_IN_DECIBAR = 10.1
 DDH_BPSL = BAROMETRIC_PRESSURE_SEA_LEVEL_IN_DECIBAR
+CNV_MAX_WORKERS = 4
+CNV_WORKERS_NICE = 10
+CNV_CSV_CHUNK_ROWS = 50000
+# no job finished for this long, a worker died hard, OOM killer...
+CNV_BATCH_STALL_SECS = 1800
+
+
+_g_cm = None
+# k: LID path, v: AsyncResult of its conversion job
+_g_jobs = {}
+_g_pool = None
+_g_batch_t = 0
+# last time a job of the batch finished, or batch start
+_g_batch_t_job = 0
+
+
+CNV_SUFFIXES = ("_DissolvedOxygen", "_Temperature", "_Pressure", "_TDO")
+
+
+def _cnv_plan_lid_file(f) -> tuple:
+    """
+    returns LID file flavor and all suffixes it can be converted to,
+    None for v2 files of a type MAT header check does not know
+    """
+    n = id_lid_file_flavor(f)
+    if n == LID_FILE_V1:
+        _map = {
+            "_DissolvedOxygen": "DOS",
+            "_Temperature": "TMP",
+            "_Pressure": "PRS"}
+        header = load_data_file(f).header()
+        return n, [s for s, t in _map.items() if header.tag(t)]
+    if n == LID_FILE_V2:
+        # v2 files only have one type of sensor data
+        for s in ("_DissolvedOxygen", "_TDO", "_Temperature", "_Pressure"):
+            if lid_file_v2_has_sensor_data_type(f, s):
+                return n, [s]
+        return n, None
+    return n, []
+
+
+def _cnv_csv_sufs(f) -> list:
+    # suffixes of CSV files of LID file f present on disk
+    return [s for s in CNV_SUFFIXES if os.path.exists(f'{f[:-4]}{s}.csv')]
+
+
+def cnv_csv_correct_columns(fp_csv, d: dict):
+    """
+    d: {column name: function numpy array -> numpy array}
+    rewrites CSV file in chunks of rows through a temporary
+    file, so it gets replaced atomically and memory is bounded
+    """
+    fp_tmp = fp_csv + '.tmp'
+    n = 0
+    d_kinds = {c: set() for c in d}
+    with open(fp_tmp, 'w') as f:
+        for df in pd.read_csv(fp_csv, chunksize=CNV_CSV_CHUNK_ROWS):
+            for c, fxn in d.items():
+                df[c] = fxn(df[c].to_numpy())
+                d_kinds[c].add(df[c].dtype.kind)
+            df.to_csv(f, index=False, header=(n == 0))
+            n += len(df)
+    if not n:
+        # header only, nothing to correct
+        os.unlink(fp_tmp)
+        return
 
-
-_g_files_we_cannot_convert = []
-_g_files_already_converted = []
+    # integer chunks among float ones, whole file at once was float
+    ls = [c for c, k in d_kinds.items() if {'i', 'f'} <= k]
+    if ls:
+        os.unlink(fp_tmp)
+        d = {c: (lambda v, _f=fxn: _f(v).astype(np.float64))
+             if c in ls else fxn for c, fxn in d.items()}
+        return cnv_csv_correct_columns(fp_csv, d)
+    os.replace(fp_tmp, fp_csv)
 
 
-def _lid_v1_file_has_sensor_data_type(path, suffix):
-    if suffix == '_TDO':
-        return
-    _map = {
-        "_DissolvedOxygen": "DOS",
-        "_Temperature": "TMP",
-        "_Pressure": "PRS"}
-    header = load_data_file(path).header()
-    return header.tag(_map[suffix])
+def _cnv_pressure_rn4020(v):
+    # absolute to gauge pressure, no negative values,
+    # all of them clipped are written as 0, not 0.0
+    v = v - DDH_BPSL
+    if not (v > 0).any():
+        return np.zeros(len(v), dtype=np.int64)
+    return np.where(v > 0, v, 0.0)
 
 
-def _cnv_lid_file_v1(path, suf):
-    f = path
-    if id_lid_file_flavor(f) != LID_FILE_V1:
-        return
-    lg.a(f"converting LID file v1 {f} for suffix {suf}")
-
-    # check v1 file header to skip files w/o this sensor data / suffix
-    if not _lid_v1_file_has_sensor_data_type(f, suf):
-        lg.a(f'warning: skip conversion, file {f} has no {suf} data')
-        return
+def _cnv_lid_file_v1(f, sufs):
+    lg.a(f"converting LID file v1 {f} for suffixes {sufs}")
 
-    # do the v1 conversion
+    # do the v1 conversion, one pass outputs all suffixes
     _params = default_parameters()
     DataConverter(f, _params).convert()
-    lg.a(f"OK: converted LID file v1 {f} for suffix {suf}")
+    lg.a(f"OK: converted LID file v1 {f} for suffixes {sufs}")
 
     # --------------------------------
     # RN4020: hack for pressure adjust
     # --------------------------------
-    if ("_Pressure" in suf) and ("moana" not in f.lower()):
+    if ("_Pressure" in sufs) and ("moana" not in f.lower()):
         lg.a("debug: adjusting LI file {}".format(f))
         fp_csv = f[:-4] + "_Pressure.csv"
-        df = pd.read_csv(fp_csv)
-        c = "Pressure (dbar)"
-        df[c] = df["Pressure (dbar)"] - DDH_BPSL
-        df[c] = df[c].apply(lambda x: x if x > 0 else 0)
-        df.to_csv(fp_csv, index=False)
+        cnv_csv_correct_columns(fp_csv, {"Pressure (dbar)": _cnv_pressure_rn4020})
 
 
-def _cnv_lid_file_v2(f, suf):
+def _cnv_lid_file_v2(f, sufs):
     # f: absolute file path ending in .lid
-    if id_lid_file_flavor(f) != LID_FILE_V2:
-        return
-    if not lid_file_v2_has_sensor_data_type(f, suf):
-        return
-    lg.a(f"converting LID file v2 {f} suffix {suf}")
+    lg.a(f"converting LID file v2 {f} suffixes {sufs}")
     convert_lix_file(f)
-    lg.a(f"OK: converted LID file v2 {f} suffix {suf}")
-
-
-def _cnv_fol_lid(fol, suf) -> list:
+    lg.a(f"OK: converted LID file v2 {f} suffixes {sufs}")
+
+
+class CnvManifest:
+
+    # ---------------------------------------------------------------
+    # persistent manifest of LID files conversions, rows are keyed by
+    # path and only valid while the LID file keeps the same size and
+    # mtime, they hold the LID flavor and the suffixes it produced or
+    # the reason it failed, so bad files are not retried every boot
+    # ---------------------------------------------------------------
+
+    def __init__(self, p):
+        self.db = sqlite3.connect(p)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cnv '
+                        '(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                        'flavor INTEGER, sufs TEXT, err TEXT)')
+        self.reload()
+
+    def reload(self):
+        # other processes, such as --retry-failed, may change the table
+        rr = self.db.execute('SELECT * FROM cnv')
+        self.d = {r[0]: r[1:] for r in rr}
+
+    def get(self, path, size, mtime):
+        # (flavor, suffixes, error) or None when unknown or changed
+        r = self.d.get(path)
+        if not r or r[:2] != (size, mtime):
+            return None
+        return r[2], [i for i in r[3].split(',') if i], r[4]
+
+    def _set(self, path, size, mtime, n, sufs, e):
+        self.d[path] = (size, mtime, n, ','.join(sufs), e)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO cnv '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            (path, size, mtime, n, ','.join(sufs), e))
+
+    def add_ok(self, path, size, mtime, n, sufs):
+        self._set(path, size, mtime, n, sufs, '')
+
+    def add_err(self, path, size, mtime, e):
+        self._set(path, size, mtime, None, [], e)
+
+    def failed(self) -> dict:
+        return {k: v[4] for k, v in self.d.items() if v[4]}
+
+    def retry_failed(self) -> list:
+        # forget failures so next conversion pass tries them again
+        ls = list(self.failed().keys())
+        if ls:
+            with self.db:
+                self.db.executemany('DELETE FROM cnv WHERE path = ?',
+                                    [(i, ) for i in ls])
+            for i in ls:
+                del self.d[i]
+        return ls
+
+    def prune(self, seen: set):
+        # forget files no longer in dl_files
+        dds_sqlite_prune(self.db, 'cnv', self.d, seen)
+
+    def close(self):
+        self.db.close()
+
+
+def _cnv_get_manifest() -> CnvManifest:
+    global _g_cm
+    if not _g_cm:
+        _g_cm = CnvManifest(get_ddh_file_path_cnv_manifest())
+    return _g_cm
+
+
+def _cnv_lid_stat(f) -> tuple:
+    st = os.stat(f)
+    return st.st_size, st.st_mtime
+
+
+def _cnv_haul_summaries(f, sufs) -> list:
+    # computed here, in the worker, saved by the main process
+    ls = []
+    for s in sufs:
+        try:
+            if os.path.exists(f'{f[:-4]}{s}.csv'):
+                ls.append(graph_haul_summary(f'{f[:-4]}{s}.csv'))
+        except (Exception, ) as ex:
+            lg.a(f'error: haul summary {f[:-4]}{s}.csv -> {ex}')
+    return ls
+
+
+def _cnv_csv_aside(bn) -> list:
+    # CSV files of a LID file are moved aside, not deleted, until its
+    # reconversion succeeds, see _cnv_csv_restore() and cnv_cli()
+    ls = []
+    for s in CNV_SUFFIXES:
+        p = f'{bn}{s}.csv'
+        # left by a past reconversion which got interrupted
+        if os.path.exists(p + '.bak') and not os.path.exists(p):
+            os.replace(p + '.bak', p)
+        if os.path.exists(p):
+            os.replace(p, p + '.bak')
+            ls.append(p)
+    return ls
+
+
+def _cnv_csv_restore(ls, ok):
+    for p in ls:
+        if ok and os.path.exists(p):
+            os.unlink(p + '.bak')
+        else:
+            # also overwrites any half-written CSV file
+            os.replace(p + '.bak', p)
+
+
+def _cnv_job(f, replace=False):
+    # f: LID file path, runs in a worker process
+    # replace: convert again even when CSV files already exist
+    el = time.perf_counter()
+    n, sufs, e = None, [], ''
+    ls_bak = []
+    ok = False
+    try:
+        n, sufs = _cnv_plan_lid_file(f)
+        bn = f[:-4]
+        if replace:
+            ls_bak = _cnv_csv_aside(bn)
+        if sufs is None:
+            # let the converter decide which CSV files there are
+            sufs = _cnv_csv_sufs(f)
+            if not sufs:
+                _cnv_lid_file_v2(f, [])
+                sufs = _cnv_csv_sufs(f)
+            if not sufs:
+                raise ValueError('LID v2 file converted to no CSV files')
+        elif [s for s in sufs if not os.path.exists(f'{bn}{s}.csv')]:
+            # convert this LID file, only once for all its suffixes
+            if n == LID_FILE_V1:
+                _cnv_lid_file_v1(f, sufs)
+            if n == LID_FILE_V2:
+                _cnv_lid_file_v2(f, sufs)
+        ok = True
+    except (ValueError, Exception) as ex:
+        e = str(ex)
+    finally:
+        # even on Ctrl-C, so good CSV files are never lost
+        _cnv_csv_restore(ls_bak, ok)
+    sufs = sufs or []
+    return f, n, sufs, e, time.perf_counter() - el, _cnv_haul_summaries(f, sufs)
+
+
+def _cnv_pool(n_w):
+    return multiprocessing.Pool(n_w, initializer=dds_pool_worker_init,
+                                initargs=('dds_cnv_w', CNV_WORKERS_NICE))
+
+
+def _cnv_lid_needs_job(cm, f, names: set) -> bool:
+    # names: files in the folder of LID file f
+    # IGNORE test_files
+    if os.path.basename(f).startswith('test'):
+        return False
+
+    # new or changed LID file, the worker will read its header
+    r = cm.get(f, *_cnv_lid_stat(f))
+    if not r:
+        return True
+
+    # IGNORE when LID file already known as bad
+    n, sufs, e = r
+    if e:
+        return False
+
+    # IGNORE when all CSV files already exist
+    bn = os.path.basename(f)[:-4]
+    return bool([s for s in sufs if f'{bn}{s}.csv' not in names])
+
+
+def _cnv_fol_lid(fol) -> list:
+    """
+    returns LID files in this folder needing conversion,
+    known ones with all their CSV files present are skipped
+    """
 
     # check folder (ex: dl_files/e5-fc-4e-94-ed-dd) exists
     if not pathlib.Path(fol).is_dir():
         lg.a(f"error: folder {fol} not found")
         return []
 
-    # check suffix (ex: _DissolvedOxygen) exists
-    valid_suffixes = ("_DissolvedOxygen", "_Temperature", "_Pressure", "_TDO")
-    if suf not in valid_suffixes:
-        lg.a(f"error: unknown suffix {suf}")
-        return []
+    # list folder only once for all LID files and suffixes
+    names = set(os.listdir(fol))
+    cm = _cnv_get_manifest()
+    return [f for f in linux_ls_by_ext(fol, "lid")
+            if _cnv_lid_needs_job(cm, f, names)]
 
-    # convert LID files
-    global _g_files_we_cannot_convert
-    global _g_files_already_converted
 
-    for f in linux_ls_by_ext(fol, "lid"):
-        # IGNORE test_files
-        if os.path.basename(f).startswith('test'):
+def _cnv_watched_lid() -> list:
+    # LID files the dl_files watcher saw written
+    cm = _cnv_get_manifest()
+    ls = []
+    for f in dlw_get_files('cnv'):
+        if not os.path.exists(f):
             continue
+        names = set(os.listdir(os.path.dirname(f)))
+        if _cnv_lid_needs_job(cm, f, names):
+            ls.append(f)
+    return ls
 
-        # IGNORE when CSV files already exists
-        f_csv = f"{f.split('.')[0]}{suf}.csv"
-        if pathlib.Path(f_csv).is_file():
-            if f_csv not in _g_files_already_converted:
-                # lg.a(f"skip conversion, CSV file {f_csv} already exists")
-                _g_files_already_converted.append(f_csv)
-            continue
 
-        # IGNORE when LID file already known as bad
-        if f in _g_files_we_cannot_convert:
-            continue
+def _cnv_batch_save(ls):
+    # atomic, a crash never leaves a half-written batch file
+    with atomic_write(get_ddh_file_path_cnv_batch()) as f:
+        json.dump(ls, f)
 
-        # try to convert this LID file
-        try:
-            _cnv_lid_file_v1(f, suf)
-            _cnv_lid_file_v2(f, suf)
 
-        except (ValueError, Exception) as ex:
-            lg.a(f"error: converting file {f}, metric {suf} --> {str(ex)}")
-            # add to black list of files
-            if f not in _g_files_we_cannot_convert:
-                lg.a(f"warning: ignoring file {f} for metric {suf} from now on")
-                _g_files_we_cannot_convert.append(f)
+def _cnv_batch_load() -> list:
+    p = get_ddh_file_path_cnv_batch()
+    if not os.path.exists(p):
+        return []
+    try:
+        with open(p, 'r') as f:
+            ls = json.load(f)
+        return [i for i in ls if os.path.exists(i)]
+    except (Exception, ) as ex:
+        lg.a(f'error: loading conversion batch file -> {ex}')
+        os.unlink(p)
+        return []
 
-    return _g_files_we_cannot_convert
+
+def _cnv_batch_start(ls):
+    global _g_pool
+    global _g_batch_t
+    global _g_batch_t_job
+    _cnv_batch_save(ls)
+    n_w = dds_pool_size(len(ls), CNV_MAX_WORKERS)
+    lg.a(f'conversion batch of {len(ls)} LID files on {n_w} worker processes')
+    _g_pool = _cnv_pool(n_w)
+    _g_batch_t = time.perf_counter()
+    _g_batch_t_job = _g_batch_t
+    for f in ls:
+        _g_jobs[f] = _g_pool.apply_async(_cnv_job, (f, ))
+
+
+def _cnv_batch_end(kill=False):
+    global _g_pool
+    if kill:
+        _g_pool.terminate()
+    else:
+        _g_pool.close()
+    _g_pool.join()
+    _g_pool = None
+    p = get_ddh_file_path_cnv_batch()
+    if os.path.exists(p):
+        os.unlink(p)
+    el = time.perf_counter() - _g_batch_t
+    lg.a(f'warning: conversion batch finished in {el:.2f} seconds')
+
+    # GUI update
+    ff = _cnv_get_manifest().failed()
+    if ff:
+        lg.a(f"error: some files are not converted")
+        for f, e in ff.items():
+            lg.a(f"\t- {f} -> {e}")
+        _u(f"{STATE_DDS_NOTIFY_CONVERSION_ERR}")
+    else:
+        _u(f"{STATE_DDS_NOTIFY_CONVERSION_OK}")
+
+
+def _cnv_manifest_add(cm, f, n, sufs, e):
+    if not os.path.exists(f):
+        return
+    if e:
+        lg.a(f"error: converting file {f} --> {e}")
+        lg.a(f"warning: ignoring file {f} from now on")
+        cm.add_err(f, *_cnv_lid_stat(f), e)
+        return
+    cm.add_ok(f, *_cnv_lid_stat(f), n, sufs)
+
+
+def _cnv_pdq_done():
+    # post-download queue conversions, so next scans skip them
+    ls = pdq_get_cnv_done()
+    if not ls:
+        return
+    cm = _cnv_get_manifest()
+    for f, n, e in ls:
+        _cnv_manifest_add(cm, f, n, _cnv_csv_sufs(f), e)
+
+
+def _cnv_batch_kill():
+    # jobs of dead workers never get ready, give up on the whole batch
+    lg.a(f'error: conversion batch stalled, killing it, '
+         f'{len(_g_jobs)} LID files left')
+    cm = _cnv_get_manifest()
+    for f in list(_g_jobs.keys()):
+        e = f'no conversion result after {CNV_BATCH_STALL_SECS} seconds'
+        _cnv_manifest_add(cm, f, None, [], e)
+    _g_jobs.clear()
+    _cnv_batch_end(kill=True)
+
+
+def _cnv_batch_poll():
+    # collect finished jobs, does not block DDS main loop
+    global _g_batch_t_job
+    done = [f for f, r in _g_jobs.items() if r.ready()]
+    if not done:
+        if time.perf_counter() - _g_batch_t_job > CNV_BATCH_STALL_SECS:
+            _cnv_batch_kill()
+        return
+    _g_batch_t_job = time.perf_counter()
+    cm = _cnv_get_manifest()
+    ls_hs = []
+    for i in done:
+        f, n, sufs, e, el, hs = _g_jobs.pop(i).get()
+        _cnv_manifest_add(cm, f, n, sufs, e)
+        ls_hs += hs
+    hsm_save(ls_hs)
+
+    # remaining jobs, so we can resume after a DDS restart
+    if _g_jobs:
+        _cnv_batch_save(list(_g_jobs.keys()))
+        return
+    _cnv_batch_end()
 
 
 def _cnv_serve():
 
+    # conversion batch running on worker processes
+    if _g_jobs:
+        _cnv_batch_poll()
+        return
+
+    # never start a batch while post-download queue may be converting
+    # the same LID files, flags below are kept for when it is idle
+    if pdq_is_busy():
+        return
+    _cnv_pdq_done()
+
+    # DDS restarted in the middle of a conversion batch
+    ls = _cnv_batch_load()
+    if ls:
+        lg.a(f'warning: resuming conversion batch, {len(ls)} LID files left')
+        _cnv_batch_start(ls)
+        return
+
     # see if someone asked conversions
     forced = os.path.exists(TMP_PATH_CNV_REQUESTED_VIA_GUI)
     if forced:
         lg.a(f'warning: conversion forced via GUI')
         os.unlink(TMP_PATH_CNV_REQUESTED_VIA_GUI)
 
-    # this function does not run always, only from time to time
+    # failures forgotten by command line, see cnv_retry_failed()
+    if os.path.exists(TMP_PATH_CNV_RETRY_FAILED):
+        lg.a(f'warning: conversion of failed files requested')
+        os.unlink(TMP_PATH_CNV_RETRY_FAILED)
+        forced = True
+
+    # the dl_files watcher lost events
+    forced = forced or dlw_get_rescan('cnv')
+
+    # full scans only from time to time, as a safety net
     if not is_it_time_to("do_some_conversions", PERIOD_CNV_SECS) and not forced:
+        # new LID files, post-download queue converted most of them
+        ls = _cnv_watched_lid()
+        if ls:
+            lg.a(f'dl_files watcher sent {len(ls)} LID files to convert')
+            _cnv_batch_start(ls)
         return
 
     # iterate mac folders
@@ -152,18 +528,20 @@ def _cnv_serve():
     mac_folders = [f.path for f in os.scandir(fol) if f.is_dir()]
     mac_folders = [f for f in mac_folders if '#' not in f]
     lg.a('warning: cnv_serve sequence started')
+    cm = _cnv_get_manifest()
+    cm.reload()
+    cm.prune({i for i in cm.d if os.path.exists(i)})
     for f in mac_folders:
         # only converts LID files, not BIN or anything
-        for m in ("_DissolvedOxygen", "_Temperature", "_Pressure", "_TDO"):
-            # same file processed for multiple metrics
-            _cnv_fol_lid(f, m)
-    lg.a('warning: cnv_serve sequence finished')
+        # same file processed for all its metrics at once
+        ls += _cnv_fol_lid(f)
+    if ls:
+        _cnv_batch_start(ls)
+        return
 
     # GUI update
-    if _g_files_we_cannot_convert:
-        lg.a(f"error: some files are not converted")
-        for f in _g_files_we_cannot_convert:
-            lg.a(f"\t- {f}")
+    lg.a('warning: cnv_serve sequence finished, nothing to convert')
+    if cm.failed():
         _u(f"{STATE_DDS_NOTIFY_CONVERSION_ERR}")
     else:
         _u(f"{STATE_DDS_NOTIFY_CONVERSION_OK}")
@@ -178,9 +556,65 @@ def cnv_serve():
             lg.a(f'{e} {ex}')
 
 
+def cnv_retry_failed() -> list:
+    """
+    forgets conversion failures, next conversion pass retries them,
+    the flag file makes a running DDS reload manifest and do it now
+    """
+    ls = _cnv_get_manifest().retry_failed()
+    lg.a(f'warning: {len(ls)} failed LID files will be converted again')
+    if ls:
+        pathlib.Path(TMP_PATH_CNV_RETRY_FAILED).touch()
+    return ls
+
+
+def cnv_cli(fol, n_w=0):
+    """
+    reconverts a whole dl_files tree, not only new files,
+    reports progress and throughput in the terminal
+    """
+    if linux_is_process_running(NAME_EXE_DDS):
+        print(f'{NAME_EXE_DDS} is running, stop it before reconverting')
+        return
+    ls = glob.glob(f"{fol}/**/*.lid", recursive=True)
+    ls = [i for i in ls if not os.path.basename(i).startswith('test')]
+    if not ls:
+        print(f'no LID files found in {fol}')
+        return
+    n_w = n_w or dds_pool_size(len(ls), CNV_MAX_WORKERS)
+    mb = sum(os.path.getsize(i) for i in ls) / 1e6
+    print(f'converting {len(ls)} LID files, {mb:.2f} MB, {n_w} workers')
+    el = time.perf_counter()
+    n_err = 0
+    cm = _cnv_get_manifest()
+    with _cnv_pool(n_w) as pool:
+        # each job replaces CSV files of its LID file only when it succeeds
+        job = functools.partial(_cnv_job, replace=True)
+        for i, rv in enumerate(pool.imap_unordered(job, ls)):
+            f, n, sufs, e, el_f, hs = rv
+            n_err += 1 if e else 0
+            _cnv_manifest_add(cm, f, n, sufs, e)
+            hsm_save(hs)
+            t = time.perf_counter() - el
+            s = f'error {e}' if e else f'{el_f:.2f} s'
+            print(f'{i + 1} / {len(ls)}, {(i + 1) / t:.2f} files/s, '
+                  f'{os.path.basename(f)} {s}')
+    el = time.perf_counter() - el
+    print(f'done {len(ls)} files in {el:.2f} s, {mb / el:.2f} MB/s, '
+          f'{n_err} errors')
+
+
 if __name__ == '__main__':
-    ff = glob.glob("/tmp/my_bkt_waf/**/*.lid", recursive=True)
-    parameters = default_parameters()
-    for i, _f in enumerate(ff):
-        print(f'doing file {i} / {len(ff)} {_f}')
-        DataConverter(_f, parameters).convert()
+    ap = argparse.ArgumentParser(description='DDH LID files converter')
+    ap.add_argument('fol', nargs='?', default=str(get_ddh_folder_path_dl_files()),
+                    help='folder to reconvert, default dl_files')
+    ap.add_argument('-w', '--workers', type=int, default=0,
+                    help='worker processes, default depends on load')
+    ap.add_argument('--retry-failed', action='store_true',
+                    help='only forget failed files so DDS converts them again')
+    args = ap.parse_args()
+    if args.retry_failed:
+        for _f in cnv_retry_failed():
+            print(f'will retry {_f}')
+    else:
+        cnv_cli(args.fol, args.workers)
@@ -1,58 +1,259 @@
+import bisect
 import datetime
 import json
 import multiprocessing
 import os
+import sqlite3
 import time
 
 import sys
 from glob import glob
+from itertools import islice
 from multiprocessing import Process
 
+import numpy as np
+import pandas as pd
 import setproctitle
 
-from dds.gpq import GpqR, FMT_GPQ_TS_FILENAME
+from dds.gpq import (GpqR, FMT_GPQ_TS_FILENAME, FMT_GPQ_TS_FILENAME_DAY,
+                     gpq_compact_closed_hours)
+from dds.dlw import dlw_get_files, dlw_get_rescan, dlw_is_active
 from dds.timecache import is_it_time_to
 from mat.linux import linux_is_process_running
-from utils.ddh_config import ddh_get_cfg_gear_type, dds_get_cfg_gpq_en
+from utils.ddh_config import (ddh_get_cfg_gear_type, dds_get_cfg_gpq_en,
+                              exp_get_cst_interp_max_gap)
 from utils.ddh_shared import (get_ddh_folder_path_dl_files,
                               get_ddh_folder_path_gpq_files,
+                              get_ddh_file_path_cst_index,
+                              atomic_write, dds_pool_size,
+                              dds_pool_worker_init, dds_sqlite_prune,
                               TESTMODE_FILENAMEPREFIX)
 from utils.logs import lg_cst as lg
 
 
 MAX_TIME_DIFF_GPS_TRACK_VS_LOGGER_SAMPLE = 30
-PATH_LID_CST_ALREADY_PROCESSED = '/tmp/cst_ls_lid_already_processed'
+CST_INTERP_MAX_GAP_SECS_DEFAULT = 120
+CST_CHUNK_ROWS = 20000
+CST_MAX_WORKERS = 4
+CST_WORKERS_NICE = 10
+CST_PERIOD_SECS = 600
+# when dl_files watcher is running, full scans are just a safety net
+CST_PERIOD_SAFETY_SECS = 3600
 
 
 _gr = GpqR()
 
 
-def _cst_get_mobile_lat_lon_from_dt_s(dt_s_iso: str):
-    # dt_s_iso: '2024-05-15T05:43:45.000Z'
-    dt_s = dt_s_iso.replace('-', '/')
-    # dt_s: '%Y/%m/%d %H:%M:%S.000Z'
-    dt_s = dt_s.replace('T', ' ')
-    print('\n')
-    return _gr.query(dt_s[:-5])
-
-
-def _purge_old_gpq_json_files():
+def _cst_get_interp_max_gap() -> int:
+    g = exp_get_cst_interp_max_gap()
+    if g == -1:
+        return CST_INTERP_MAX_GAP_SECS_DEFAULT
+    return int(g)
+
+
+def _cst_stream(f_csv, f_cst, fxn_rows):
+    """
+    reads CSV in blocks of rows so memory stays the same for any file size,
+    fxn_rows(rows) returns the CST text for them, rows are copied untouched,
+    CST file only appears, atomically renamed, when complete
+    """
+    with open(f_csv, 'r') as fv, atomic_write(f_cst, fsync=True) as ft:
+        ft.write('lat,lon,' + fv.readline())
+        while 1:
+            rows = list(islice(fv, CST_CHUNK_ROWS))
+            if not rows:
+                break
+            if not rows[-1].endswith('\n'):
+                rows[-1] += '\n'
+            ft.write(fxn_rows(rows))
+
+
+def _cst_rows_to_datetime64(rows: list) -> np.ndarray:
+    # rows[i]: '2024-05-15T05:43:45.000Z,...', bad ones become NaT
+    s = pd.Series(rows, dtype=object).str.slice(0, 19)
+    dt = pd.to_datetime(s, format='%Y-%m-%dT%H:%M:%S', errors='coerce')
+    return dt.to_numpy(dtype='datetime64[s]')
+
+
+def _cst_join_mobile(ts: np.ndarray):
+    """
+    CSV timestamps vs. GPQ fixes, returns lat, lon arrays,
+    interpolated between fixes up to max gap apart, otherwise
+    fix just before when close enough, otherwise NaN
+    """
+    if not len(ts):
+        return np.full(0, np.nan), np.full(0, np.nan)
+
+    # fix just before, NaN comparisons are False
+    _, diff, lat, lon = _gr.query_many(ts)
+    ok = diff <= MAX_TIME_DIFF_GPS_TRACK_VS_LOGGER_SAMPLE
+    lat, lon = np.where(ok, lat, np.nan), np.where(ok, lon, np.nan)
+
+    # better, interpolated, also fills small GPS gaps
+    mg = _cst_get_interp_max_gap()
+    if mg > 0:
+        i_lat, i_lon = _gr.query_many_interp(ts, mg)
+        ok = ~np.isnan(i_lat)
+        lat, lon = np.where(ok, i_lat, lat), np.where(ok, i_lon, lon)
+    return lat, lon
+
+
+def _cst_build_lat_lon_prefixes(lat, lon):
+    # 'lat,lon,' prefix for every row, ',,' when position is unknown
+    s_lat = np.char.add(np.char.mod('%+.6f', lat), ',')
+    s_lon = np.char.add(np.char.mod('%+.6f', lon), ',')
+    return np.where(np.isnan(lat), ',,', np.char.add(s_lat, s_lon))
+
+
+def _purge_old_gpq_files():
     # calculate last accepted filename by subtracting from today
     _d = -2
     now = datetime.datetime.now(datetime.timezone.utc)
     now += datetime.timedelta(days=_d)
     fol = get_ddh_folder_path_gpq_files()
-    ls = glob(f'{fol}/mobile*.json')
-    # filename: mobile_24071216.json
-    f = f'{fol}/mobile_{now.strftime(FMT_GPQ_TS_FILENAME)}'
-    ls_del = [i for i in ls if i < f]
+
+    # whole days, filename: mobile_240712.npz
+    f = f'{fol}/mobile_{now.strftime(FMT_GPQ_TS_FILENAME_DAY)}'
+    ls_del = [i for i in glob(f'{fol}/mobile_*.npz') if i < f]
+
+    # hours not compacted, filename: mobile_24071216.json, mobile_24071216.gpq
+    f = f'{fol}/mobile_{now.strftime(FMT_GPQ_TS_FILENAME)}'[:-5]
+    ls = glob(f'{fol}/mobile*.json') + glob(f'{fol}/mobile*.gpq')
+    ls_del += [i for i in ls if os.path.splitext(i)[0] < f]
+
     for i in ls_del:
         bn = os.path.basename(i)
         lg.a(f'warning: deleting {bn}, older than {_d * -1} days')
         os.unlink(i)
 
 
-def _create_cst_files():
+def _cst_file_fixed(i_lid, f_csv, f_cst):
+    # CST file created with 1 location from fixed_*.json GPQ file
+    f_gpq = f'{get_ddh_folder_path_gpq_files()}/'\
+            f'fixed_{os.path.basename(i_lid[:-4])}.json'
+    _bn = os.path.basename(f_gpq)
+    if not os.path.exists(f_gpq):
+        lg.a(f'warning: no fixed GPQ file {_bn}')
+        return
+    lg.a(f'querying fixed GPQ file {_bn}')
+    with open(f_gpq, 'r') as f:
+        d = json.load(f)
+
+    # CST fixed file, GPS location repeated every CSV line, one write per block
+    pre = f'{d["dl_lat"]},{d["dl_lon"]},'
+
+    def _rows_fixed(rows):
+        return pre + ''.join(rows)[:-1].replace('\n', '\n' + pre) + '\n'
+
+    _cst_stream(f_csv, f_cst, _rows_fixed)
+
+
+def _cst_file_mobile(f_csv, f_cst):
+    # CST file uses N locations from mobile GPQ files
+    n, n_bad = 0, 0
+
+    def _rows_mobile(rows):
+        nonlocal n, n_bad
+        ts = _cst_rows_to_datetime64(rows)
+        lat, lon = _cst_join_mobile(ts)
+        pre = _cst_build_lat_lon_prefixes(lat, lon)
+        n += len(rows)
+        n_bad += int(np.count_nonzero(np.isnan(lat)))
+        return ''.join(map(str.__add__, pre.tolist(), rows))
+
+    _cst_stream(f_csv, f_cst, _rows_mobile)
+    if n_bad:
+        lg.a(f'warning: CST has {n_bad} rows without GPS position')
+    print(f'CST: output file has {n - n_bad} OK complete records')
+
+
+def _cst_job(job):
+    # job: (i_lid, f_csv, f_cst, gear_type), runs in a worker process,
+    # GPQ cache stats are cumulative for this worker, hence the pid
+    i_lid, f_csv, f_cst, _gear_type = job
+    el = time.perf_counter()
+    try:
+        if _gear_type == 0:
+            _cst_file_fixed(i_lid, f_csv, f_cst)
+        if _gear_type == 1:
+            _cst_file_mobile(f_csv, f_cst)
+        e = ''
+    except (Exception, ) as ex:
+        e = str(ex)
+    return i_lid, e, time.perf_counter() - el, os.getpid(), _gr.stats()
+
+
+class CstIndex:
+
+    # ---------------------------------------------------------------
+    # persistent index of LID files already CST processed, sqlite is
+    # crash-safe, rows are keyed by path and only valid while the LID
+    # file keeps the same size and mtime, new rows are committed once
+    # per pass, one fsync instead of one per LID file on the SD card
+    # ---------------------------------------------------------------
+
+    def __init__(self, p):
+        self.db = sqlite3.connect(p)
+        self.db.execute('CREATE TABLE IF NOT EXISTS cst '
+                        '(path TEXT PRIMARY KEY, size INTEGER, mtime REAL)')
+        rr = self.db.execute('SELECT path, size, mtime FROM cst')
+        self.d = {r[0]: (r[1], r[2]) for r in rr}
+        self.ls_new = []
+
+    def has(self, path, size, mtime) -> bool:
+        return self.d.get(path) == (size, mtime)
+
+    def add(self, path, size, mtime):
+        # written by commit()
+        self.d[path] = (size, mtime)
+        self.ls_new.append((path, size, mtime))
+
+    def commit(self):
+        if not self.ls_new:
+            return
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO cst VALUES (?, ?, ?)',
+                                self.ls_new)
+        self.ls_new = []
+
+    def prune(self, seen: set):
+        # forget files no longer in dl_files
+        dds_sqlite_prune(self.db, 'cst', self.d, seen)
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def _cst_walk_dl_files(fol):
+    """
+    only one walk of dl_files folder per run, returns
+        - list of (LID path, size, mtime)
+        - {folder: sorted file names}, to find CSV and CST files
+    """
+    ls_lid, d_names = [], {}
+    for root, dirs, files in os.walk(fol):
+        names = sorted(i for i in files if not i.startswith('.'))
+        d_names[root] = names
+        for i in names:
+            if i.endswith('.lid'):
+                st = os.stat(f'{root}/{i}')
+                ls_lid.append((f'{root}/{i}', st.st_size, st.st_mtime))
+    return ls_lid, d_names
+
+
+def _cst_find_csv(names: list, i_lid):
+    # first CSV file starting as LID file, names are sorted
+    stem = os.path.basename(i_lid)[:-4]
+    i = bisect.bisect_left(names, stem)
+    while i < len(names) and names[i].startswith(stem):
+        if names[i].endswith('.csv'):
+            return f'{os.path.dirname(i_lid)}/{names[i]}'
+        i += 1
+
+
+def _create_cst_files(fols=None):
+    # fols: only walk these folders, default whole dl_files
 
     if not dds_get_cfg_gpq_en():
         # instead of return prevents zombie processes
@@ -61,23 +262,26 @@ def _create_cst_files():
     # 0 normal, 1 trawling
     _gear_type = ddh_get_cfg_gear_type()
     fol = get_ddh_folder_path_dl_files()
-    ls_lid = glob(f'{fol}/**/*.lid', recursive=True)
-
-    # save us some work
-    ls_lid_already_processed = []
-    try:
-        with open(PATH_LID_CST_ALREADY_PROCESSED) as f:
-            ls_lid_already_processed = f.read().splitlines()
-    except (Exception, ) as ex:
-        pass
+    ls_lid, d_names = [], {}
+    for i in fols or [fol]:
+        _ls, _d = _cst_walk_dl_files(i)
+        ls_lid += _ls
+        d_names.update(_d)
+
+    # save us some work, survives reboots
+    ci = CstIndex(get_ddh_file_path_cst_index())
+    if not fols:
+        ci.prune(set(i[0] for i in ls_lid))
+    d_lid = {}
 
     # ---------------------------------------------------
-    # input: GPQ files (JSON) + timestamp from CSV files
-    # output: CST files
+    # input: GPQ files + timestamp from CSV files
+    # output: CST files, one job per LID file
     # ---------------------------------------------------
-    for i_lid in ls_lid:
+    jobs = []
+    for i_lid, size, mtime in ls_lid:
 
-        if i_lid in ls_lid_already_processed:
+        if ci.has(i_lid, size, mtime):
             continue
 
         # avoid test files
@@ -85,97 +289,73 @@ def _create_cst_files():
         if TESTMODE_FILENAMEPREFIX in _bn:
             # we don't CST process testfiles_
             lg.a(f'warning: skipped and added {_bn} to already processed')
-            ls_lid_already_processed.append(i_lid)
+            ci.add(i_lid, size, mtime)
             continue
 
         # be sure we have CSV for this LID file
-        f_csv_mask = f'{i_lid[:-4]}*.csv'
-        f_csv = glob(f_csv_mask)
+        names = d_names[os.path.dirname(i_lid)]
+        f_csv = _cst_find_csv(names, i_lid)
         if not f_csv:
             lg.a(f'warning: doing CST but seen no CSV file for {_bn}')
             continue
-        f_csv = f_csv[0]
 
         # infer CST filename from CSV filename
         f_cst = f_csv.replace('.csv', '.cst')
-        if os.path.exists(f_cst):
-            # CST file already exists, bye
+        _bn_cst = os.path.basename(f_cst)
+        j = bisect.bisect_left(names, _bn_cst)
+        if j < len(names) and names[j] == _bn_cst:
+            # CST file already exists, no need to look at it again
+            ci.add(i_lid, size, mtime)
             continue
 
-        # read lines of CSV file
-        with open(f_csv, 'r') as fv:
-            ll_fv = fv.readlines()
-            _bn = os.path.basename(f_csv)
-            lg.a(f'generating CST from file {_bn}, {len(ll_fv)} lines')
-
-        # ------------------------------------------------------------------------
-        # fixed mode: CST file created with 1 location from fixed_*.json GPQ file
-        # ------------------------------------------------------------------------
-        if _gear_type == 0:
-            f_gpq = f'{get_ddh_folder_path_gpq_files()}/'\
-                    f'fixed_{os.path.basename(i_lid[:-4])}.json'
-            _bn = os.path.basename(f_gpq)
-            if os.path.exists(f_gpq):
-                lg.a(f'querying fixed GPQ file {_bn}')
-                with open(f_gpq, 'r') as f:
-                    d = json.load(f)
-
-                # CST fixed file, GPS location repeated every CSV line
-                with open(f_cst, 'w') as ft:
-                    ft.write('lat,lon,' + ll_fv[0])
-                    for s in ll_fv[1:]:
-                        ft.write(f'{d["dl_lat"]},{d["dl_lon"]},' + s)
-            else:
-                lg.a(f'warning: no fixed GPQ file {_bn}')
-
-        # --------------------------------------------------------------------
-        # mobile mode: CST file uses N locations from mobile_*.json GPQ files
-        # --------------------------------------------------------------------
+        jobs.append((i_lid, f_csv, f_cst, _gear_type))
+        d_lid[i_lid] = (size, mtime)
+
+    # run the jobs in parallel, lower priority than BLE
+    n_jobs = len(jobs)
+    if n_jobs:
+        n_w = dds_pool_size(n_jobs, CST_MAX_WORKERS)
+        lg.a(f'CST running {n_jobs} jobs on {n_w} worker processes')
+        el_all = time.perf_counter()
+        d_st = {}
+        with multiprocessing.Pool(
+                n_w, initializer=dds_pool_worker_init,
+                initargs=('dds_cst_w', CST_WORKERS_NICE)) as pool:
+            for i, rv in enumerate(pool.imap_unordered(_cst_job, jobs)):
+                i_lid, e, el, pid, st = rv
+                d_st[pid] = st
+                _bn = os.path.basename(i_lid)
+                if e:
+                    lg.a(f'error: CST job {i + 1} / {n_jobs} for {_bn} -> {e}')
+                    continue
+                lg.a(f'CST job {i + 1} / {n_jobs} done {_bn} in {el:.2f} seconds')
+
+                # we do not process input files over and over
+                ci.add(i_lid, *d_lid[i_lid])
+        el_all = time.perf_counter() - el_all
+        lg.a(f'CST {n_jobs} jobs done in {el_all:.2f} seconds')
+
+        # useful to size the GPQ cache, see 'gpq_cache_mb'
         if _gear_type == 1:
-            ft = open(f_cst, 'w')
-            ft.write('lat,lon,' + ll_fv[0])
-            ok_i = 0
-            for row in ll_fv[1:]:
-                dt_s = row.split(',')[0]
-
-                # CST mobile file, GPS location asked to GPQ DB for every CSV line
-                index, diff, t_lat_lon = _cst_get_mobile_lat_lon_from_dt_s(dt_s)
-                if index > 0:
-                    # -1, means none, 0 means too early
-                    t, latlon = t_lat_lon
-                    lat, lon = latlon
-                    if diff <= MAX_TIME_DIFF_GPS_TRACK_VS_LOGGER_SAMPLE:
-                        ft.write(f'{lat},{lon},' + row)
-                        ok_i += 1
-                    else:
-                        ft.write(f',,' + row)
-                        print(f'CST: discarding {dt_s}')
-                        print(f'\tdiff {diff} > {MAX_TIME_DIFF_GPS_TRACK_VS_LOGGER_SAMPLE}')
-                else:
-                    ft.write(f',,' + row)
-            print(f'CST: output file has {ok_i} OK complete records')
-            ft.close()
-
-        # we do not process input files over and over
-        _bn = os.path.basename(i_lid)
-        lg.a(f'added {_bn} to CST already processed')
-        ls_lid_already_processed.append(i_lid)
+            st = {k: sum(i[k] for i in d_st.values())
+                  for k in ('hits', 'misses', 'evictions', 'hours', 'bytes')}
+            # cache size limit is per worker
+            st['max_bytes'] = max(i['max_bytes'] for i in d_st.values())
+            lg.a(f'GPQ cache stats, {len(d_st)} workers {st}')
 
-    # update this file which saves us time
-    with open(PATH_LID_CST_ALREADY_PROCESSED, 'w') as f:
-        for i in ls_lid_already_processed:
-            f.write(i + '\n')
+    ci.close()
 
 
 def cst_serve():
 
     _P_ = "dds_cst"
 
-    def _cst_serve():
+    def _cst_serve(fols):
         setproctitle.setproctitle(_P_)
         try:
-            _purge_old_gpq_json_files()
-            _create_cst_files()
+            _purge_old_gpq_files()
+            gpq_compact_closed_hours()
+            _create_cst_files(fols)
         except (Exception, ) as ex:
             lg.a(f'error: CST_serve exception -> {ex}')
 
@@ -187,10 +367,16 @@ def cst_serve():
     if linux_is_process_running(_P_):
         lg.a(f"error: seems last {_P_} took a long time")
     else:
+        # new CSV files seen by dl_files watcher, only walk their folders
+        fols = sorted(set(os.path.dirname(i) for i in dlw_get_files('cst')))
         s = f'launching {_P_}'
-        if is_it_time_to(s, 600):
+        _t = CST_PERIOD_SAFETY_SECS if dlw_is_active() else CST_PERIOD_SECS
+        if is_it_time_to(s, _t) or dlw_get_rescan('cst'):
             # lg.a(s)
-            p = Process(target=_cst_serve)
+            p = Process(target=_cst_serve, args=(None, ))
+            p.start()
+        elif fols:
+            p = Process(target=_cst_serve, args=(fols, ))
             p.start()
 
 
@@ -0,0 +1,152 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+
+from utils.ddh_shared import get_ddh_folder_path_dl_files
+from utils.logs import lg_dds as lg
+
+
+"""
+dl_files watcher, inotify tells us which files are new or changed
+so CNV, CST and GFM stages do not need to glob the whole dl_files
+"""
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+DLW_EVENT_FMT = 'iIII'
+DLW_EVENT_LEN = struct.calcsize(DLW_EVENT_FMT)
+DLW_CONSUMERS = ('cnv', 'cst', 'gfm')
+
+
+_g_dlw = None
+_g_dlw_failed = False
+# k: consumer, v: set of new or changed file paths
+_g_dlw_files = {k: set() for k in DLW_CONSUMERS}
+# k: consumer, v: inotify overflowed, consumer needs a full scan
+_g_dlw_rescan = {k: False for k in DLW_CONSUMERS}
+
+
+class DlWatcher:
+
+    # ---------------------------------------------------------------
+    # inotify via libc, no extra packages, watches dl_files for new
+    # mac folders and each mac folder for files written or moved in
+    # ---------------------------------------------------------------
+
+    def __init__(self, fol):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.fol = str(fol)
+        # k: watch descriptor, v: folder
+        self.wd = {}
+        self._add(self.fol, IN_CREATE | IN_MOVED_TO)
+        for i in os.scandir(self.fol):
+            if i.is_dir():
+                self._add(i.path, IN_CLOSE_WRITE | IN_MOVED_TO)
+
+    def _add(self, fol, mask):
+        wd = self.libc.inotify_add_watch(self.fd, fol.encode(), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch {fol}')
+        self.wd[wd] = fol
+
+    def read(self):
+        """
+        returns set of files written since last call,
+        None when events were lost and a full scan is needed
+        """
+        rv = set()
+        while 1:
+            try:
+                b = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return rv
+            i = 0
+            while i < len(b):
+                wd, mask, _, n = struct.unpack_from(DLW_EVENT_FMT, b, i)
+                name = b[i + DLW_EVENT_LEN:i + DLW_EVENT_LEN + n]
+                name = name.rstrip(b'\0').decode()
+                i += DLW_EVENT_LEN + n
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                fol = self.wd.get(wd)
+                if not fol or not name:
+                    continue
+                p = f'{fol}/{name}'
+                if fol == self.fol:
+                    if mask & IN_ISDIR:
+                        # new mac folder, files may be there already
+                        self._add(p, IN_CLOSE_WRITE | IN_MOVED_TO)
+                        rv.update(i.path for i in os.scandir(p)
+                                  if i.is_file())
+                    continue
+                rv.add(p)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _dlw_route(p) -> tuple:
+    # which consumers want this file
+    bn = os.path.basename(p)
+    if '#' in p or bn.startswith('.'):
+        return ()
+    if bn.endswith('.lid'):
+        return 'cnv',
+    if bn.endswith('_TDO.csv') or bn.endswith('_DissolvedOxygen.csv'):
+        return 'cst', 'gfm'
+    if bn.endswith('.csv'):
+        # v1 _Temperature, _Pressure... CST does any CSV from a LID
+        return 'cst',
+    return ()
+
+
+def dlw_serve():
+    global _g_dlw
+    global _g_dlw_failed
+    if _g_dlw_failed:
+        return
+    try:
+        if not _g_dlw:
+            _g_dlw = DlWatcher(get_ddh_folder_path_dl_files())
+            lg.a(f'dl_files watcher started, {len(_g_dlw.wd)} folders')
+        ls = _g_dlw.read()
+    except (Exception, ) as ex:
+        # consumers keep using their periodic scans
+        lg.a(f'error: dl_files watcher -> {ex}')
+        _g_dlw_failed = True
+        return
+
+    if ls is None:
+        lg.a('warning: dl_files watcher lost events, requesting scans')
+        for k in DLW_CONSUMERS:
+            _g_dlw_rescan[k] = True
+        return
+    for p in ls:
+        for k in _dlw_route(p):
+            _g_dlw_files[k].add(p)
+
+
+def dlw_is_active() -> bool:
+    return bool(_g_dlw) and not _g_dlw_failed
+
+
+def dlw_get_files(k) -> list:
+    # consumes the new files for this stage
+    ls = sorted(_g_dlw_files[k])
+    _g_dlw_files[k].clear()
+    return ls
+
+
+def dlw_get_rescan(k) -> bool:
+    rv = _g_dlw_rescan[k]
+    _g_dlw_rescan[k] = False
+    return rv
@@ -1,17 +1,44 @@
-import bisect
 import glob
+import io
 import json
 import os
+import struct
 import time
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from os.path import basename
 
+import numpy as np
 from pysondb import DB
 
-from utils.ddh_shared import get_ddh_folder_path_gpq_files
+from utils.ddh_config import exp_get_gpq_cache_mb
+from utils.ddh_shared import atomic_write, get_ddh_folder_path_gpq_files
+from utils.logs import lg_gpq as lg
 
 FMT_GPQ_TS_RECORD_DB = '%Y/%m/%d %H:%M:%S'
 FMT_GPQ_TS_FILENAME = '%y%m%d%H.json'
+FMT_GPQ_TS_FILENAME_SEG = '%y%m%d%H.gpq'
+
+
+# -----------------------------------------------------------
+# mobile_YYMMDDHH.gpq segments are append-only binary files,
+# one fixed-size record per GPS fix: epoch UTC, lat, lon
+# -----------------------------------------------------------
+GPQ_REC_FMT = '<qdd'
+GPQ_REC_SIZE = struct.calcsize(GPQ_REC_FMT)
+GPQ_DTYPE = np.dtype([('t', '<i8'), ('lat', '<f8'), ('lon', '<f8')])
+GPQ_FSYNC_EVERY_N_RECORDS = 30
+
+
+# ------------------------------------------------------------
+# closed hours get compacted in daily mobile_YYMMDD.npz files,
+# columns t, lat, lon + idx, 25 offsets, hour h is idx[h]:idx[h + 1]
+# ------------------------------------------------------------
+FMT_GPQ_TS_FILENAME_DAY = '%y%m%d.npz'
+
+
+# GpqR memory budget, 1 fix / second is ~84 KB / hour
+GPQ_CACHE_MAX_BYTES_DEFAULT = 4 * 1024 * 1024
 
 
 # -----------------------------------------------
@@ -33,104 +60,418 @@ def _p(s):
     print(s)
 
 
+def gpq_get_cache_max_bytes() -> int:
+    mb = exp_get_gpq_cache_mb()
+    if mb == -1:
+        return GPQ_CACHE_MAX_BYTES_DEFAULT
+    return int(float(mb) * 1024 * 1024)
+
+
+def gpq_dt_to_epoch(dt: datetime) -> int:
+    # GPS datetimes are naive but UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def gpq_epoch_to_s(ep) -> str:
+    dt = datetime.fromtimestamp(int(ep), tz=timezone.utc)
+    return dt.strftime(FMT_GPQ_TS_RECORD_DB)
+
+
+def gpq_read_mobile_segment(p) -> np.ndarray:
+    """
+    returns (t, lat, lon) structured array from a mobile_*.gpq file,
+    a partial record at the end, power cut while writing, is ignored
+    """
+    with open(p, 'rb') as f:
+        b = f.read()
+    n = len(b) - (len(b) % GPQ_REC_SIZE)
+    return np.frombuffer(b[:n], dtype=GPQ_DTYPE).copy()
+
+
+def gpq_read_mobile_day(p) -> dict:
+    """
+    returns {'24071216': structured array, ...} from a mobile_*.npz
+    daily file, it does only one read of the whole file
+    """
+    with open(p, 'rb') as f:
+        b = f.read()
+    z = np.load(io.BytesIO(b))
+    day = basename(p)[7:13]
+    idx = z['idx']
+    d = {}
+    for h in range(24):
+        i, j = idx[h], idx[h + 1]
+        if i == j:
+            continue
+        a = np.empty(j - i, dtype=GPQ_DTYPE)
+        a['t'], a['lat'], a['lon'] = z['t'][i:j], z['lat'][i:j], z['lon'][i:j]
+        d[f'{day}{h:02d}'] = a
+    return d
+
+
+def _gpq_write_mobile_day(p, d: dict):
+    # d: {'24071216': structured array, ...}, all from same day
+    ls = [np.sort(d[k], order='t', kind='stable') for k in sorted(d)]
+    a = np.concatenate(ls) if ls else np.empty(0, dtype=GPQ_DTYPE)
+    hh = [int(k[-2:]) for k in sorted(d)]
+    n = np.zeros(24, dtype=np.int64)
+    n[hh] = [len(i) for i in ls]
+    idx = np.concatenate(([0], np.cumsum(n)))
+
+    # atomic, readers never see half a day
+    with atomic_write(p, 'wb', fsync=True) as f:
+        np.savez(f, t=a['t'], lat=a['lat'], lon=a['lon'], idx=idx)
+
+
+def gpq_compact_closed_hours():
+    """
+    merges hourly mobile_*.gpq files of closed hours into their daily
+    mobile_*.npz file, the current and previous hour are left alone
+    because GpqW may still be writing them
+    """
+    fol = get_ddh_folder_path_gpq_files()
+    now = datetime.now(timezone.utc) - timedelta(hours=1)
+    f_open = f'{fol}/mobile_' + now.strftime(FMT_GPQ_TS_FILENAME_SEG)
+    ls = sorted(glob.glob(f'{fol}/mobile_*.gpq'))
+    ls = [i for i in ls if i < f_open]
+
+    # group hours by day
+    dd = {}
+    for i in ls:
+        dd.setdefault(basename(i)[7:13], []).append(i)
+
+    for day, ls_h in dd.items():
+        p = f'{fol}/mobile_{day}.npz'
+        try:
+            d = gpq_read_mobile_day(p) if os.path.exists(p) else {}
+            for i in ls_h:
+                k = basename(i)[7:15]
+                a = gpq_read_mobile_segment(i)
+                if k in d:
+                    # late fixes, for example, after a GPS clock jump
+                    a = np.concatenate((d[k], a))
+                d[k] = a
+            _gpq_write_mobile_day(p, d)
+            for i in ls_h:
+                os.unlink(i)
+            lg.a(f'compacted {len(ls_h)} GPQ hours into {basename(p)}')
+        except (Exception, ) as ex:
+            lg.a(f'error: compacting GPQ day {day} -> {ex}')
+
+
+def gpq_import_mobile_json_files():
+    """
+    converts legacy mobile_*.json pysondb files to mobile_*.gpq segments
+    """
+    fol = get_ddh_folder_path_gpq_files()
+    ls = sorted(glob.glob(f'{fol}/mobile_*.json'))
+    for p in ls:
+        try:
+            db = DB(keys=['t', 'lat', 'lon'])
+            db.load(p)
+            rr = []
+            for r in db.get_all().values():
+                dt = datetime.strptime(r['t'], FMT_GPQ_TS_RECORD_DB)
+                rr.append((gpq_dt_to_epoch(dt), float(r['lat']), float(r['lon'])))
+            rr.sort()
+            with open(p[:-5] + '.gpq', 'ab') as f:
+                for r in rr:
+                    f.write(struct.pack(GPQ_REC_FMT, *r))
+                f.flush()
+                os.fsync(f.fileno())
+            os.unlink(p)
+            lg.a(f'imported {len(rr)} rows from legacy GPQ file {basename(p)}')
+        except (Exception, ) as ex:
+            lg.a(f'error: importing legacy GPQ file {basename(p)} -> {ex}')
+
+
 class GpqW:
 
     # -----------------------------------------------------------------
     # used by GPS module to record positions on MOBILE mode, not fixed
+    # records are appended to hourly segments and flushed on every fix
+    # so other processes see them, only fsync goes in batches, this way
+    # we don't rewrite the whole hour on every fix, nice for SD cards
     # -----------------------------------------------------------------
 
     def __init__(self):
-        self.db = DB(keys=['t', 'lat', 'lon'])
+        self.f = None
+        self.p = ''
+        self.n_not_synced = 0
+        self.json_imported = False
+
+    def _sync(self):
+        if not self.f:
+            return
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.n_not_synced = 0
+
+    def close(self):
+        if not self.f:
+            return
+        self._sync()
+        self.f.close()
+        self.f = None
+        self.p = ''
 
     def add(self, dt: datetime, lat, lon):
-        f = 'mobile_' + dt.strftime(FMT_GPQ_TS_FILENAME)
+
+        # only once, older DDH versions wrote JSON files
+        if not self.json_imported:
+            gpq_import_mobile_json_files()
+            self.json_imported = True
+
+        f = 'mobile_' + dt.strftime(FMT_GPQ_TS_FILENAME_SEG)
         p = f'{get_ddh_folder_path_gpq_files()}/{f}'
-        os.makedirs(os.path.dirname(p), exist_ok=True)
-        dt_s = dt.strftime(FMT_GPQ_TS_RECORD_DB)
-        if os.path.exists(p):
-            _p(f'GPQ_W: already exists {f}')
-        self.db.load(p)
-        self.db.add({'t': dt_s, 'lat': lat, 'lon': lon})
-        self.db.commit(p)
-        _p(f'GPQ_W: add {dt_s} -> {f}')
+
+        # new hour, new segment
+        if p != self.p:
+            self.close()
+            os.makedirs(os.path.dirname(p), exist_ok=True)
+            if os.path.exists(p):
+                _p(f'GPQ_W: already exists {f}')
+            self.f = open(p, 'ab')
+            # power cut mid-record, or we append misaligned records
+            n = self.f.tell()
+            if n % GPQ_REC_SIZE:
+                lg.a(f'warning: truncating partial GPQ record at end of {f}')
+                self.f.truncate(n - n % GPQ_REC_SIZE)
+            self.p = p
+
+        ep = gpq_dt_to_epoch(dt)
+        self.f.write(struct.pack(GPQ_REC_FMT, ep, float(lat), float(lon)))
+        # kernel has it, so CST on other processes can read it right away
+        self.f.flush()
+        self.n_not_synced += 1
+        if self.n_not_synced >= GPQ_FSYNC_EVERY_N_RECORDS:
+            self._sync()
+        if VERBOSE:
+            _p(f'GPQ_W: add {gpq_epoch_to_s(ep)} -> {f}')
 
 
 class GpqR:
 
     # ----------------------------------------------------
     # used to get gps positions on MOBILE mode, not fixed
+    # keeps one sorted NumPy (t, lat, lon) array per hour
     # ----------------------------------------------------
 
-    def __init__(self):
+    def __init__(self, max_bytes=0):
         self.db = DB(keys=['t', 'lat', 'lon'])
-        self.ls = []
-        self.all = {}
+        # k: '24071216', v: structured array sorted by time
+        # least recently used hours are evicted to respect budget
+        self.segs = OrderedDict()
+        # k: 'mobile_240712.npz', v: (mtime, hours it contains)
+        self.days = {}
+        self.n_bytes = 0
+        self.max_bytes = max_bytes or gpq_get_cache_max_bytes()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self):
+        # keep at least the newest hour, even if it is huge
+        while self.n_bytes > self.max_bytes and len(self.segs) > 1:
+            k, a = self.segs.popitem(last=False)
+            self.n_bytes -= a.nbytes
+            self.evictions += 1
+            _p(f'GPQ_R: evicted -> {k}')
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hours': len(self.segs),
+            'bytes': self.n_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+    def _load_legacy_json(self, p):
+        self.db.load(p)
+        _rr = self.db.get_all().values()
+        a = np.empty(len(_rr), dtype=GPQ_DTYPE)
+        for i, r in enumerate(_rr):
+            dt = datetime.strptime(r['t'], FMT_GPQ_TS_RECORD_DB)
+            a[i] = (gpq_dt_to_epoch(dt), float(r['lat']), float(r['lon']))
+        return a
 
     def _load(self, dt: datetime):
 
-        # infer the database filename
-        f = 'mobile_' + dt.strftime(FMT_GPQ_TS_FILENAME)
+        k = dt.strftime('%y%m%d%H')
+        if k in self.segs:
+            _p(f'GPQ_R: load already -> {k}')
+            self.segs.move_to_end(k)
+            self.hits += 1
+            return
+        self.misses += 1
+
+        # closed hours live in daily files
+        if self._load_day(dt):
+            return
+
+        # infer the database filename, binary segment or legacy JSON
+        f = 'mobile_' + dt.strftime(FMT_GPQ_TS_FILENAME_SEG)
         p = f'{get_ddh_folder_path_gpq_files()}/{f}'
+        if not os.path.exists(p):
+            f = 'mobile_' + dt.strftime(FMT_GPQ_TS_FILENAME)
+            p = f'{get_ddh_folder_path_gpq_files()}/{f}'
         _p(f'GPQ_R: value {dt} -> load ask for file {f}')
         if not os.path.exists(p):
             _p(f'GPQ_R: load error -> {basename(p)} file does not exist')
             return
-        if f in self.ls:
-            _p(f'GPQ_R: load already -> {basename(p)}')
-            return
 
         # load the database filename
-        self.db.load(p)
-        _rr = self.db.get_all().values()
-        _p(f'GPQ_R: load OK -> {len(_rr)} rows from {basename(p)}')
-        d = {r['t']: (r['lat'], r['lon']) for r in _rr}
-        self.all.update(d)
-        self.ls.append(f)
+        if p.endswith('.gpq'):
+            a = gpq_read_mobile_segment(p)
+        else:
+            a = self._load_legacy_json(p)
+        a = np.sort(a, order='t', kind='stable')
+        _p(f'GPQ_R: load OK -> {len(a)} rows from {basename(p)}')
+        self._add(k, a)
+
+    def _add(self, k, a):
+        if k in self.segs:
+            self.n_bytes -= self.segs.pop(k).nbytes
+        self.segs[k] = a
+        self.n_bytes += a.nbytes
+        self._evict()
+
+    def _load_day(self, dt: datetime) -> bool:
+        # returns True when hour got loaded from its daily file
+        f = 'mobile_' + dt.strftime(FMT_GPQ_TS_FILENAME_DAY)
+        p = f'{get_ddh_folder_path_gpq_files()}/{f}'
+        if not os.path.exists(p):
+            return False
+
+        # same day file already read and this hour is not in it
+        k = dt.strftime('%y%m%d%H')
+        mt = os.path.getmtime(p)
+        day = self.days.get(f)
+        if day and day[0] == mt and k not in day[1]:
+            return False
+
+        # one read gets all hours of the day
+        d = gpq_read_mobile_day(p)
+        self.days[f] = (mt, set(d.keys()))
+        _p(f'GPQ_R: load OK -> {len(d)} hours from {f}')
+        # asked hour goes last so it is the newest one in cache
+        for i in sorted(d.keys(), key=lambda x: (x == k, x)):
+            self._add(i, d[i])
+        return k in d
+
+    def _index(self, ts):
+        # load hours needed by timestamps, plus immediately previous and
+        # next ones, bad timestamps such as NaT are not valid hours
+        hh = np.unique(ts[ts > 0] // 3600)
+        hh = np.union1d(np.union1d(hh, hh - 1), hh + 1)
+        ls = []
+        for h in hh:
+            dt = datetime.fromtimestamp(int(h) * 3600, tz=timezone.utc)
+            self._load(dt)
+            # grab it now, a later _load() may evict it
+            k = dt.strftime('%y%m%d%H')
+            if k in self.segs:
+                ls.append(self.segs[k])
+        if not ls:
+            return np.empty(0, dtype=GPQ_DTYPE)
+        # hours are sorted and so is each one of them
+        return np.concatenate(ls)
+
+    @staticmethod
+    def _to_epochs(timestamps) -> np.ndarray:
+        ts = np.asarray(timestamps)
+        if ts.dtype.kind == 'M':
+            ts = ts.astype('datetime64[s]').astype(np.int64)
+        return ts.astype(np.int64)
+
+    def query_many(self, timestamps):
+        """
+        resolves all timestamps at once, they can be epoch
+        seconds UTC or numpy datetime64, returns arrays:
+            i: index of 1st fix after timestamp, 0 means too early
+            diff: seconds timestamp vs. fix just before it, NaN if none
+            lat, lon: position of such fix, NaN if none
+        """
+        ts = self._to_epochs(timestamps)
+        a = self._index(ts)
+        i = np.searchsorted(a['t'], ts, side='right')
+        ok = i > 0
+        j = np.where(ok, i - 1, 0)
+        if not len(a):
+            nan = np.full(len(ts), np.nan)
+            return i, nan, nan.copy(), nan.copy()
+        diff = np.where(ok, ts - a['t'][j], np.nan)
+        lat = np.where(ok, a['lat'][j], np.nan)
+        lon = np.where(ok, a['lon'][j], np.nan)
+        return i, diff, lat, lon
+
+    def query_many_interp(self, timestamps, max_gap):
+        """
+        same timestamps as query_many(), returns lat, lon arrays linearly
+        interpolated between the fixes just before and after each
+        timestamp, NaN when there are not both or they are more
+        than max_gap seconds apart
+        """
+        ts = self._to_epochs(timestamps)
+        a = self._index(ts)
+        nan = np.full(len(ts), np.nan)
+        if not len(a):
+            return nan, nan.copy()
+        i = np.searchsorted(a['t'], ts, side='right')
+        ok = (i > 0) & (i < len(a))
+        j0 = np.clip(i - 1, 0, len(a) - 1)
+        j1 = np.clip(i, 0, len(a) - 1)
+        t0, t1 = a['t'][j0], a['t'][j1]
+        gap = t1 - t0
+        ok &= gap <= max_gap
+
+        # exact hits have gap 0, use fix before
+        w = np.divide(ts - t0, gap, out=np.zeros(len(ts)), where=gap > 0)
+        lat = a['lat'][j0] + w * (a['lat'][j1] - a['lat'][j0])
+        lon = a['lon'][j0] + w * (a['lon'][j1] - a['lon'][j0])
+        return np.where(ok, lat, nan), np.where(ok, lon, nan)
 
     def query(self, s: str):
 
         # s: '2024/04/05 21:45:22'
         dt = datetime.strptime(s, FMT_GPQ_TS_RECORD_DB)
+        ep = gpq_dt_to_epoch(dt)
 
-        # build dictionary w/ current database and immediately previous one
-        self._load(dt)
-        dt_bef = dt - timedelta(hours=1)
-        self._load(dt_bef)
-        t = list(self.all.keys())
-
-        # our built big dictionary does not even have values
-        if not t:
+        # our big index, current hour and immediately previous one
+        a = self._index(np.array([ep], dtype=np.int64))
+        if not len(a):
             return -1, -1, None
-        _p(f'GPQ_R: value query {s}')
-        _p(f'GPQ_R: range GPQ DB [ {t[0]} - {t[-1]} ] = {len(t)} rows')
-        i = bisect.bisect_right(t, s)
-
-        # value is too early for our big dictionary
+        if VERBOSE:
+            _p(f'GPQ_R: value query {s}')
+            _p(f'GPQ_R: range GPQ DB [ {gpq_epoch_to_s(a["t"][0])} - '
+               f'{gpq_epoch_to_s(a["t"][-1])} ] = {len(a)} rows')
+        i, diff, lat, lon = self.query_many([ep])
+        i, _diff = int(i[0]), float(diff[0])
+
+        # value is too early for our big index
         if i == 0:
             _p(f'\tvalue {s} -> pre-range')
             return 0, -1, None
 
         # value might be useful for calling functions,
         # such as CST, depending on diff
-        if i >= len(t):
+        if i >= len(a):
             _p(f'\tvalue {s} -> post-range')
         else:
             _p(f'\tvalue {s} -> in-range')
-        now = datetime.strptime(s, FMT_GPQ_TS_RECORD_DB)
-        bef = datetime.strptime(t[i - 1], FMT_GPQ_TS_RECORD_DB)
-        _diff = (now - bef).total_seconds()
-        _p(f'\ti {i}')
-        _p(f'\tdiff {i}')
-
-        # get the closest candidate value
-        c = list(self.all.items())[i - 1]
-        if i != -1:
+        t = gpq_epoch_to_s(ep - _diff)
+        c = (t, (f'{lat[0]:+.6f}', f'{lon[0]:+.6f}'))
+        if VERBOSE:
             _p(f'\tcandidate {c}')
 
         # the calling function decides if _diff is ok or too much
         # i: index in array
         # _diff: seconds current time vs. closest one in array
-        # c: ('2024/05/14 09:45:39', ('lat990', 'lon990'))
+        # c: ('2024/05/14 09:45:39', ('+41.123456', '-70.123456'))
         return i, _diff, c
 
 
@@ -165,15 +506,16 @@ def _gpq_gen_test():
     # file name is today down to hour
     # ------------------------------------------------
     p = get_ddh_folder_path_gpq_files()
-    for i in glob.glob(f'{p}/*.json'):
+    for i in glob.glob(f'{p}/mobile_*'):
         print(f'removing file {basename(i)}')
         os.unlink(i)
     print('testing GpqW')
-    dn = datetime.now()
+    dn = datetime.utcnow()
     g = GpqW()
     for i in range(0, 1000, 10):
-        g.add(datetime.now() + timedelta(seconds=i),
-              f'lat{i}', f'lon{i}')
+        g.add(dn + timedelta(seconds=i),
+              f'{41 + i / 1000:+.6f}', f'{-70 - i / 1000:+.6f}')
+    g.close()
 
     # useful for debug
     # return
@@ -0,0 +1,91 @@
+import glob
+import json
+import os
+import threading
+
+from utils.ddh_shared import atomic_write, get_ddh_folder_path_dl_files
+from utils.logs import lg_cnv as lg
+
+
+"""
+haul summaries, one record per TDO / DO CSV file computed by DDS
+after conversion, so GUI and API do not need to read the data
+"""
+
+
+# one per dl_files/<mac> folder, k: CSV file basename, v: record
+HSM_FILENAME = '._hsm.json'
+
+
+# conversion batch and post-download queue may both save
+_g_lock = threading.Lock()
+
+
+def hsm_load(fol) -> dict:
+    try:
+        with open(f'{fol}/{HSM_FILENAME}') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (Exception, ) as ex:
+        lg.a(f'error: loading haul summaries {fol} -> {ex}')
+        return {}
+
+
+def hsm_load_all() -> dict:
+    # k: mac folder name, v: its haul summaries
+    d = str(get_ddh_folder_path_dl_files())
+    return {os.path.basename(os.path.dirname(p)): hsm_load(os.path.dirname(p))
+            for p in sorted(glob.glob(f'{d}/*/{HSM_FILENAME}'))}
+
+
+def hsm_save(ls_rec: list):
+    """
+    ls_rec: records built by graph_haul_summary(), files that
+    no longer exist get their records removed from the folder
+    """
+    d_fol = {}
+    for r in ls_rec:
+        if r:
+            d_fol.setdefault(r['folder'], []).append(r)
+
+    with _g_lock:
+        for fol, ls in d_fol.items():
+            d = hsm_load(fol)
+            d.update({r['file']: r for r in ls})
+            d = {k: v for k, v in d.items() if os.path.exists(f'{fol}/{k}')}
+            p = f'{fol}/{HSM_FILENAME}'
+            try:
+                with atomic_write(p) as f:
+                    json.dump(d, f)
+            except (Exception, ) as ex:
+                lg.a(f'error: saving haul summaries {p} -> {ex}')
+                continue
+            lg.a(f'saved {len(ls)} haul summaries for {os.path.basename(fol)}')
+
+
+def hsm_get_fresh(d: dict, f):
+    """
+    record of CSV file f from d, loaded by hsm_load(),
+    None when there is none or it is older than the file
+    """
+    r = d.get(os.path.basename(f))
+    try:
+        if r and r['mtime_ns'] == os.stat(f).st_mtime_ns:
+            return r
+    except FileNotFoundError:
+        pass
+
+
+def hsm_combine(ls_rec: list) -> dict:
+    """
+    bottom means of several hauls, weighted by number of samples
+    """
+    rv = {'n': sum(r['bottom']['n'] for r in ls_rec)}
+    for k in ('pressure_dbar', 'temperature_c', 'do_mg_l'):
+        ls = [(r['bottom']['n'], r['bottom'][k]) for r in ls_rec
+              if r['bottom'].get(k) is not None]
+        w = sum(i for i, _ in ls)
+        if w:
+            rv[k] = sum(i * v for i, v in ls) / w
+    return rv
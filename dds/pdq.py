@@ -0,0 +1,229 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from ddh.utils_graph import graph_haul_summary, utils_graph_set_fol_req_file
+from dds.aws import aws_cp
+from dds.hsm import hsm_save
+from dds.notifications_v2 import (
+    LoggerNotification,
+    notify_logger_dox_hypoxia
+)
+from mat.data_converter import default_parameters, DataConverter
+from mat.lix import id_lid_file_flavor, LID_FILE_V2, LID_FILE_V1
+from mat.lix_dox import is_a_do2_file
+from mat.lix_pr import convert_lix_file
+from utils.ddh_config import dds_get_cfg_logger_mac_from_sn
+from utils.ddh_shared import (
+    send_ddh_udp_gui as _u,
+    atomic_write,
+    STATE_DDS_NOTIFY_PDQ,
+    STATE_DDS_REQUEST_GRAPH
+)
+from utils.flag_paths import TMP_PATH_PDQ_STATE_JSON
+from utils.logs import lg_pdq as lg
+
+
+"""
+post-download queue, jobs run by one worker thread in order,
+so the BLE loop goes back to scanning right after a download
+"""
+
+
+PDQ_KINDS = ('cnv', 'aws_cp', 'graph')
+
+
+_g_q = queue.Queue()
+# (LID file, flavor, error) of conversions, cnv_serve() adds them to
+# its manifest on DDS main thread, so they are not planned once more
+_g_cnv_done = queue.Queue()
+_g_th = None
+_g_lock = threading.Lock()
+_g_state = {
+    'pending': [],
+    'running': '',
+    'done': 0,
+    'errors': 0,
+    'last_error': ''
+}
+
+
+def _pdq_job_desc(j: dict) -> str:
+    if j['kind'] == 'graph':
+        return f"graph {j['mac']}"
+    return f"{j['kind']} {len(j['files'])} files"
+
+
+def _pdq_state_save():
+    # GUI gets pending count, API reads the whole file, BLE and
+    # pdq threads both save, so snapshot and write under the lock
+    with _g_lock:
+        d = dict(_g_state)
+        d['pending'] = list(_g_state['pending'])
+        try:
+            with atomic_write(TMP_PATH_PDQ_STATE_JSON) as f:
+                json.dump(d, f)
+        except (Exception, ) as ex:
+            lg.a(f'error: saving {TMP_PATH_PDQ_STATE_JSON} -> {ex}')
+    n = len(d['pending']) + (1 if d['running'] else 0)
+    _u(f"{STATE_DDS_NOTIFY_PDQ}/{n}")
+
+
+def _pdq_detect_hypoxia(f_lid, bat, g, u=''):
+    try:
+        if not f_lid.endswith('.lid') or not is_a_do2_file(f_lid):
+            return
+        f_csv = f_lid.replace('.lid', '_DissolvedOxygen.csv')
+        if not os.path.exists(f_csv):
+            return
+
+        # f_csv: 2404725_lab_20240407_230609.csv
+        sn = os.path.basename(f_csv).split('_')[0]
+        mac = dds_get_cfg_logger_mac_from_sn(sn)
+        ln = LoggerNotification(mac, sn, 'DOX', bat)
+        ln.uuid_interaction = u
+        with open(f_csv, 'r') as f:
+            ll = f.readlines()
+            # headers: 'ISO 8601 Time,elapsed time (s),agg. time(s),Dissolved Oxygen (mg/l)...
+            for i in ll[1:]:
+                do_mg_l = float(i.split(',')[3])
+                if do_mg_l <= 0.0:
+                    notify_logger_dox_hypoxia(g, ln)
+                    break
+    except (Exception, ) as ex:
+        lg.a(f'error: testing _pdq_detect_hypoxia -> {ex}')
+
+
+def _pdq_cnv(j: dict):
+    ls_lid = [f for f in j['files'] if '.lid' in f]
+    bat = j['bat']
+    g = j['gps']
+    u = j['uuid_interaction']
+
+    for f in ls_lid:
+        # f: absolute file path ending in .lid
+        _bn = os.path.basename(f)
+        n = None
+        try:
+            n = id_lid_file_flavor(f)
+            lg.a(f"post-download conversion of LID v{n} file {_bn} started")
+
+            # ----------------------------
+            # convert DOX and TDO v2 files
+            # ----------------------------
+            if n == LID_FILE_V2:
+                convert_lix_file(f)
+                _pdq_detect_hypoxia(f, bat, g, u)
+
+            if n == LID_FILE_V1:
+                # do the old MAT library conversion
+                parameters = default_parameters()
+                DataConverter(f, parameters).convert()
+        except (Exception, ) as ex:
+            _g_cnv_done.put((f, n, str(ex)))
+            raise
+        _g_cnv_done.put((f, n, ''))
+        lg.a(f"OK: post-download conversion of LID v{n} file {_bn} ended")
+
+        # so GUI and API have the summary of this haul right away
+        ls = [f[:-4] + s for s in ('_TDO.csv', '_DissolvedOxygen.csv')]
+        try:
+            hsm_save([graph_haul_summary(i) for i in ls if os.path.exists(i)])
+        except (Exception, ) as ex:
+            lg.a(f'error: post-download haul summary {_bn} -> {ex}')
+
+
+def _pdq_graph(j: dict):
+    mac, sn = j['mac'], j['sn']
+    utils_graph_set_fol_req_file(mac)
+    lg.a(f"triggering post-download graph for logger {sn}, mac {mac}")
+    _u(STATE_DDS_REQUEST_GRAPH)
+
+
+def _pdq_run(j: dict):
+    if j['kind'] == 'cnv':
+        _pdq_cnv(j)
+    elif j['kind'] == 'aws_cp':
+        aws_cp(j['files'])
+    elif j['kind'] == 'graph':
+        _pdq_graph(j)
+
+
+def _th_pdq_serve():
+    while 1:
+        j = _g_q.get()
+        s = _pdq_job_desc(j)
+        with _g_lock:
+            _g_state['pending'].pop(0)
+            _g_state['running'] = s
+        _pdq_state_save()
+
+        el = time.perf_counter()
+        e = ''
+        try:
+            _pdq_run(j)
+        except (Exception, ) as ex:
+            e = f'{s} -> {ex}'
+            lg.a(f'error: post-download job {e}')
+        el = time.perf_counter() - el
+        lg.a(f'post-download job {s} done in {el:.2f} seconds')
+
+        with _g_lock:
+            _g_state['running'] = ''
+            _g_state['done'] += 1
+            if e:
+                _g_state['errors'] += 1
+                _g_state['last_error'] = e
+        _pdq_state_save()
+        _g_q.task_done()
+
+
+def _pdq_add(j: dict):
+    global _g_th
+    assert j['kind'] in PDQ_KINDS
+    if not _g_th:
+        _g_th = threading.Thread(target=_th_pdq_serve, daemon=True)
+        _g_th.start()
+    with _g_lock:
+        _g_state['pending'].append(_pdq_job_desc(j))
+    _g_q.put(j)
+    _pdq_state_save()
+
+
+def pdq_add_cnv(notes: dict):
+    _pdq_add({
+        'kind': 'cnv',
+        'files': list(notes['dl_files']),
+        'bat': notes['battery_level'],
+        'gps': notes['gps'],
+        'uuid_interaction': notes['uuid_interaction']
+    })
+
+
+def pdq_add_aws_cp(files: list):
+    _pdq_add({'kind': 'aws_cp', 'files': list(files)})
+
+
+def pdq_add_graph(mac, sn):
+    _pdq_add({'kind': 'graph', 'mac': mac, 'sn': sn})
+
+
+def pdq_is_busy() -> bool:
+    return _g_q.unfinished_tasks > 0
+
+
+def pdq_get_cnv_done() -> list:
+    # consumes the conversion outcomes since last call
+    ls = []
+    while not _g_cnv_done.empty():
+        ls.append(_g_cnv_done.get())
+    return ls
+
+
+def pdq_get_state() -> dict:
+    with _g_lock:
+        d = dict(_g_state)
+        d['pending'] = list(_g_state['pending'])
+    return d
@@ -25,6 +25,7 @@ from api.api_utils import (api_get_ip_vpn, api_get_ip_wlan, api_get_ip_cell,
                            get_files_from_server, api_get_gps_iface,
                            api_get_fw_cell_version, api_get_wlan_mbps,
                            api_get_internet_via, api_get_kernel, api_send_email_crash, api_linux_is_process_running,
+                           api_get_post_download_queue, api_get_haul_summaries,
                            )
 from ddh.db.db_his import DbHis
 from utils.ddh_config import (dds_get_cfg_vessel_name,
@@ -95,6 +96,15 @@ async def ep_history():
         return {"history": CTT_API_ER, "entries": {}}
 
 
+@app.get('/haul_summaries')
+async def ep_haul_summaries():
+    # k: mac folder, v: one summary per TDO / DO file, see dds/hsm.py
+    r = api_get_haul_summaries()
+    if r is None:
+        return {"haul_summaries": CTT_API_ER, "entries": {}}
+    return {"haul_summaries": CTT_API_OK, "entries": r}
+
+
 ep = 'upload_conf'
 
 
@@ -165,6 +175,7 @@ async def api_get_info():
         "uptime_secs": _th(api_get_uptime_secs),
         "ble_state": _th(api_get_ble_state),
         "ble_iface_used": _th(api_get_ble_iface),
+        "post_download_queue": _th(api_get_post_download_queue),
         "gps_iface_used": _th(api_get_gps_iface),
         "aws_sqs_state": _th(api_read_aws_sqs_ts),
         "boat_prj": _th(dds_get_cfg_box_project),
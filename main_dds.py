@@ -13,6 +13,7 @@ from dds.ble import ble_interact_all_loggers, ble_show_antenna_type, ble_check_a
 from dds.ble_scan import ble_scan
 from dds.cnv import cnv_serve
 from dds.cst import cst_serve
+from dds.dlw import dlw_serve
 from dds.gps import (
     gps_boot_wait_first,
     gps_measure,
@@ -164,7 +165,8 @@ def main_dds():
         gps_power_cycle_if_so()
         gps_configure_shield()
 
-        # other stages
+        # other stages, watcher first so they know about new files
+        dlw_serve()
         cst_serve()
         gfm_serve()
         cnv_serve()
@@ -302,6 +302,14 @@ def exp_get_ble_do_crc():
     return _get_exp_key_from_cfg('ble_do_crc')
 
 
+def exp_get_gpq_cache_mb():
+    return _get_exp_key_from_cfg('gpq_cache_mb')
+
+
+def exp_get_cst_interp_max_gap():
+    return _get_exp_key_from_cfg('cst_interp_max_gap')
+
+
 def exp_get_conf_tdo():
     rv = _get_exp_key_from_cfg('conf_tdo')
     if rv == -1:
@@ -358,3 +366,5 @@ if __name__ == '__main__':
     print('ddh_flag_maps_en', ddh_get_cfg_maps_en())
     print('conf_tdo', exp_get_conf_tdo())
     print('conf_dox', exp_get_conf_dox())
+    print('gpq_cache_mb', exp_get_gpq_cache_mb())
+    print('cst_interp_max_gap', exp_get_cst_interp_max_gap())
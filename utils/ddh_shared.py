@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import datetime
 import glob
 import pathlib
@@ -10,6 +11,7 @@ from pathlib import Path
 from git import InvalidGitRepositoryError
 import subprocess as sp
 from mat.utils import linux_is_rpi, linux_is_rpi3, linux_is_rpi4
+import setproctitle
 import toml
 
 from utils.flag_paths import TMP_PATH_GUI_CLOSED_FLAG, TMP_PATH_DISABLE_BLE, TMP_PATH_AWS_HAS_WORK_VIA_GUI, \
@@ -72,6 +74,9 @@ STATE_DDS_NOTIFY_CONVERSION_OK = "conversion_ok"
 STATE_DDS_REQUEST_GRAPH = "graph_request"
 
 
+STATE_DDS_NOTIFY_PDQ = "post_download_queue"
+
+
 STATE_DDS_SOFTWARE_UPDATED = "software_updated"
 STATE_DDS_GPS_POWER_CYCLE = "gps_power_cycle"
 
@@ -219,6 +224,21 @@ def get_ddh_folder_path_gpq_files() -> Path:
     return Path(f"{p}/dds/gpq")
 
 
+def get_ddh_file_path_cst_index() -> str:
+    p = str(ddh_get_root_folder_path())
+    return f"{p}/dds/cst_index.db"
+
+
+def get_ddh_file_path_cnv_batch() -> str:
+    p = str(ddh_get_root_folder_path())
+    return f"{p}/dds/cnv_batch.json"
+
+
+def get_ddh_file_path_cnv_manifest() -> str:
+    p = str(ddh_get_root_folder_path())
+    return f"{p}/dds/cnv_manifest.db"
+
+
 def dds_create_folder_gpq():
     r = get_ddh_folder_path_gpq_files()
     os.makedirs(r, exist_ok=True)
@@ -427,6 +447,50 @@ def set_ddh_language_file_content(lang):
         f.write('language = ' + lang)
 
 
+@contextlib.contextmanager
+def atomic_write(p, mode='w', fsync=False):
+    """
+    file object to write p through a temporary file, which replaces
+    p only when the block ends OK, so readers never see half a file
+    """
+    p_tmp = p + '.tmp'
+    try:
+        with open(p_tmp, mode) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(p_tmp, p)
+    except BaseException:
+        if os.path.exists(p_tmp):
+            os.unlink(p_tmp)
+        raise
+
+
+def dds_pool_size(n_jobs, n_max) -> int:
+    # free cores, keep at least one for DDS main loop / BLE
+    n_cpu = os.cpu_count() or 1
+    n_free = n_cpu - 1 - int(round(os.getloadavg()[0]))
+    return max(1, min(n_jobs, n_free, n_max))
+
+
+def dds_pool_worker_init(name, nice):
+    setproctitle.setproctitle(name)
+    # BLE downloads are more important than this
+    os.nice(nice)
+
+
+def dds_sqlite_prune(db, table, d: dict, seen: set):
+    # forget rows of d, and its sqlite table, for paths not seen
+    ls = [(i, ) for i in d if i not in seen]
+    if not ls:
+        return
+    with db:
+        db.executemany(f'DELETE FROM {table} WHERE path = ?', ls)
+    for i, in ls:
+        del d[i]
+
+
 def main():
     get_ddh_toml_all_macs_content()
 
@@ -39,6 +39,9 @@ TMP_PATH_AWS_HAS_WORK_VIA_GUI = "/tmp/ddh_aws_has_something_to_do_via_gui.flag"
 # indicates the DDH GUI requested a CNV process
 TMP_PATH_CNV_REQUESTED_VIA_GUI = "/tmp/ddh_cnv_requested_via_gui.flag"
 
+# indicates failed conversions were forgotten via command line
+TMP_PATH_CNV_RETRY_FAILED = "/tmp/ddh_cnv_retry_failed.flag"
+
 # indicates the DDH GUI updated itself (beta)
 TMP_PATH_DDH_GOT_UPDATE = "/tmp/ddh_got_update_file.flag"
 
@@ -49,6 +52,9 @@ TMP_PATH_DDH_APP_OVERRIDE = "/tmp/ddh_app_override_file.flag"
 # internet via
 TMP_PATH_INET_VIA = '/tmp/ddh_internet_via.json'
 
+# written by DDS with the state of its post-download jobs queue
+TMP_PATH_PDQ_STATE_JSON = '/tmp/ddh_pdq_state.json'
+
 
 # stored in "li" folder, permanent on DDH even after update, temporary on dev platform
 d = '/home/pi/li/' if _is_rpi() else '/tmp'
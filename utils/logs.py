@@ -103,6 +103,7 @@ lg_gra = DDSLogs("gra")
 lg_cst = DDSLogs("cst")
 lg_gpq = DDSLogs("gpq")
 lg_sta = DDSLogs("sta")
+lg_pdq = DDSLogs("pdq")
 
 
 # these NORMAL logs are local
@@ -13,3 +13,7 @@ def dbar_to_fathoms(dbar):
     feet = dbar_to_feet(dbar)
     fath = feet_to_fathoms(feet)
     return fath
+
+
+def celsius_to_fahrenheit(c):
+    return (c * 9 / 5) + 32